@@ -7,6 +7,14 @@ import threading
 import time
 import ipaddress
 import shutil
+import errno
+import signal
+import random
+import gzip
+import json
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from functools import wraps
 from flask import Flask, jsonify, render_template, request, abort, Response, send_from_directory
@@ -16,6 +24,46 @@ API_URL = os.getenv("API_URL", "http://localhost:8457/api")
 VIDEO_URL = os.getenv("VIDEO_URL", "http://localhost:8457/video/")
 API_TOKEN = os.getenv("API_TOKEN", "")
 SCAN_INTERVAL = int(os.getenv("SCAN_INTERVAL", 60)) # Default 60 minutes
+WATCH_MODE = os.getenv("WATCH_MODE", "off").lower() # off, auto, inotify, poll
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", 10)) # Seconds of quiet before syncing changes
+WATCH_POLL_INTERVAL = int(os.getenv("WATCH_POLL_INTERVAL", 60)) # Seconds between polls (poll mode)
+WATCH_FULL_SCAN_INTERVAL = int(os.getenv("WATCH_FULL_SCAN_INTERVAL", 1440)) # Safety-net full scan (minutes) while watching
+SCAN_TIME_BUDGET = int(os.getenv("SCAN_TIME_BUDGET", 0)) # Stop a full scan after this many minutes, 0 = no limit
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", 0)) # 0 = size from encoder and core count
+TRANSCODE_MAX_ATTEMPTS = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", 2)) # Automatic tries per job
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", 4)) # Parallel ffprobe processes during discovery
+ORPHAN_CHECK_WORKERS = int(os.getenv("ORPHAN_CHECK_WORKERS", 16)) # Parallel stat calls when checking links
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 8)) # Channel folders listed in parallel
+RECOVERY_WORKERS = int(os.getenv("RECOVERY_WORKERS", 2)) # Concurrent yt-dlp batches
+RECOVERY_BATCH_SIZE = int(os.getenv("RECOVERY_BATCH_SIZE", 25)) # Videos per yt-dlp invocation
+RECOVERY_SLEEP_REQUESTS = float(os.getenv("RECOVERY_SLEEP_REQUESTS", 1)) # Seconds yt-dlp waits between requests
+RECOVERY_UNAVAILABLE_DAYS = int(os.getenv("RECOVERY_UNAVAILABLE_DAYS", 30)) # Don't retry "Video unavailable" IDs for this long
+COPY_CONCURRENCY = int(os.getenv("COPY_CONCURRENCY", 2)) # Cross-filesystem copies running at once
+COPY_MAX_MBPS = float(os.getenv("COPY_MAX_MBPS", 0)) # Bandwidth cap per copy in MB/s, 0 = unlimited
+ORPHAN_RECHECK_HOURS = float(os.getenv("ORPHAN_RECHECK_HOURS", 24)) # Skip links verified more recently than this
+ORPHAN_AUTO_REPAIR = os.getenv("ORPHAN_AUTO_REPAIR", "true").lower() == "true" # Relink broken links whose video moved
+TRANSCODE_CHUNKED = os.getenv("TRANSCODE_CHUNKED", "false").lower() == "true" # Segment-parallel libx264 for long videos
+TRANSCODE_CHUNK_SECONDS = int(os.getenv("TRANSCODE_CHUNK_SECONDS", 300)) # Target segment length
+TRANSCODE_CHUNK_MIN_DURATION = int(os.getenv("TRANSCODE_CHUNK_MIN_DURATION", 1200)) # Only chunk videos at least this long (s)
+TRANSCODE_CHUNK_WORKERS = int(os.getenv("TRANSCODE_CHUNK_WORKERS", 0)) # 0 = one encoder per 4 cores
+TRANSCODE_SCRATCH_DIR = os.getenv("TRANSCODE_SCRATCH_DIR", "") # Local disk/tmpfs for encoder output; empty = next to the source
+TRANSCODE_SCRATCH_RESERVE_MB = int(os.getenv("TRANSCODE_SCRATCH_RESERVE_MB", 1024)) # Free space to leave on the scratch disk
+# Target profile: what direct-plays without work. Anything else gets the cheapest fix.
+TRANSCODE_TARGET_VIDEO = {c.strip() for c in os.getenv("TRANSCODE_TARGET_VIDEO", "h264").split(",") if c.strip()}
+TRANSCODE_TARGET_AUDIO = {c.strip() for c in os.getenv("TRANSCODE_TARGET_AUDIO", "aac").split(",") if c.strip()}
+TRANSCODE_TARGET_CONTAINERS = {c.strip() for c in os.getenv("TRANSCODE_TARGET_CONTAINERS", "mp4,mov").split(",") if c.strip()}
+TRANSCODE_RENAME_EXTENSION = os.getenv("TRANSCODE_RENAME_EXTENSION", "false").lower() == "true" # Rename rewritten files to .mp4
+TRANSCODE_NICE = int(os.getenv("TRANSCODE_NICE", 10)) # CPU niceness for ffmpeg (0 = normal)
+TRANSCODE_IONICE = os.getenv("TRANSCODE_IONICE", "idle") # idle, best-effort, or empty for normal I/O priority
+TRANSCODE_MAX_LOAD = float(os.getenv("TRANSCODE_MAX_LOAD", 0)) # 1-minute load average above which no new jobs start (0 = off)
+TRANSCODE_BULK_WINDOW = os.getenv("TRANSCODE_BULK_WINDOW", "") # e.g. 22:00-06:00; bulk jobs only start inside it (empty = always)
+METADATA_FULL_SYNC_HOURS = int(os.getenv("METADATA_FULL_SYNC_HOURS", 24)) # Full TA reconcile interval
+METADATA_TTL = int(os.getenv("METADATA_TTL", 300)) # Seconds a metadata snapshot is shared before re-syncing
+TA_API_TIMEOUT = float(os.getenv("TA_API_TIMEOUT", 30)) # Seconds per request
+TA_API_RETRIES = int(os.getenv("TA_API_RETRIES", 4))
+TA_API_CONCURRENCY = int(os.getenv("TA_API_CONCURRENCY", 4)) # Parallel page fetches
+TA_BREAKER_THRESHOLD = int(os.getenv("TA_BREAKER_THRESHOLD", 5)) # Failed requests before the breaker opens
+TA_BREAKER_COOLDOWN = int(os.getenv("TA_BREAKER_COOLDOWN", 60)) # Seconds before retrying an open breaker
 ALLOWED_IPS = [ip.strip() for ip in os.getenv("ALLOWED_IPS", "127.0.0.1").split(",")]
 UI_USERNAME = os.getenv("UI_USERNAME", "admin")
 UI_PASSWORD = os.getenv("UI_PASSWORD", "password")
@@ -23,6 +71,8 @@ SOURCE_DIR = Path("/app/source")
 TARGET_DIR = Path("/app/target")
 HIDDEN_DIR = Path("/app/hidden")
 IMPORT_DIR = Path("/app/import")
+HOST_SOURCE_DIR = Path(os.getenv("HOST_SOURCE_DIR", "/mnt/user/tubearchives/bp")) # SOURCE_DIR as seen by the media server
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.webm', '.mov'}
 HEADERS = {"Authorization": f"Token {API_TOKEN}"}
 
 # Serve static files from ui/dist
@@ -31,19 +81,67 @@ app = Flask(__name__, static_folder=STATIC_FOLDER, static_url_path='/')
 
 # Database setup
 import sqlite3
+import queue
 from contextlib import contextmanager
 
 DB_PATH = Path("/app/data/videos.db")
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL") # Use DELETE if /app/data is on a network share
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8)) # Idle connections kept open
+DB_BATCH_SIZE = 1000 # Rows per executemany chunk / commit
+
+db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+db_local = threading.local()
+
+def connect_db():
+    """Opens a tuned connection. WAL lets dashboard reads run while a scan writes."""
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000") # ~16 MB page cache
+    conn.execute("PRAGMA mmap_size=134217728")
+    return conn
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
+    """
+    Yields a pooled connection, bound to the calling thread until the
+    outermost `with get_db()` exits (nested calls share it). Uncommitted
+    work is rolled back on exit so no write lock outlives the block.
+    """
+    conn = getattr(db_local, "conn", None)
+    if conn is not None:
+        db_local.depth += 1
+        try:
+            yield conn
+        finally:
+            db_local.depth -= 1
+        return
+
+    try:
+        conn = db_pool.get_nowait()
+    except queue.Empty:
+        conn = connect_db()
+    db_local.conn = conn
+    db_local.depth = 1
     try:
         yield conn
     finally:
-        conn.close()
+        db_local.conn = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            db_pool.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+def chunked(items, size=DB_BATCH_SIZE):
+    """Splits a list into lists of at most size items."""
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
 def init_db():
     with get_db() as conn:
@@ -65,9 +163,121 @@ def init_db():
             CREATE TABLE IF NOT EXISTS hidden_channels (
                 channel_name TEXT PRIMARY KEY
             );
+            CREATE TABLE IF NOT EXISTS ta_metadata (
+                video_id TEXT PRIMARY KEY,
+                title TEXT,
+                channel_name TEXT,
+                published TEXT,
+                media_url TEXT,
+                downloaded TEXT,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS app_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS transcode_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filepath TEXT NOT NULL,
+                priority INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                encoder TEXT,
+                error TEXT,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started TIMESTAMP,
+                finished TIMESTAMP,
+                temp_paths TEXT
+            );
+            CREATE TABLE IF NOT EXISTS probe_cache (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                data TEXT,
+                probed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS media_info (
+                video_id TEXT PRIMARY KEY,
+                path TEXT,
+                channel TEXT,
+                size INTEGER,
+                mtime REAL,
+                video_codec TEXT,
+                audio_codec TEXT,
+                width INTEGER,
+                height INTEGER,
+                bitrate INTEGER,
+                duration REAL,
+                container TEXT,
+                action TEXT,
+                probed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_media_info_action ON media_info(action);
+            CREATE TABLE IF NOT EXISTS transcode_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER,
+                filepath TEXT,
+                encoder TEXT,
+                mode TEXT,
+                duration REAL,
+                wall_seconds REAL,
+                cpu_seconds REAL,
+                speed REAL,
+                input_size INTEGER,
+                output_size INTEGER,
+                finished TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS link_checks (
+                path TEXT PRIMARY KEY,
+                target TEXT,
+                ok INTEGER,
+                checked REAL
+            );
+            CREATE TABLE IF NOT EXISTS recovery_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scan_id INTEGER,
+                category TEXT,
+                path TEXT,
+                data TEXT
+            );
+            CREATE TABLE IF NOT EXISTS recovery_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filepath TEXT NOT NULL,
+                video_id TEXT,
+                status TEXT DEFAULT 'queued',
+                message TEXT,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished TIMESTAMP
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_recovery_jobs_active
+                ON recovery_jobs(filepath) WHERE status IN ('queued', 'running');
+            CREATE TABLE IF NOT EXISTS unavailable_videos (
+                video_id TEXT PRIMARY KEY,
+                reason TEXT,
+                checked TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_transcode_jobs_active
+                ON transcode_jobs (filepath) WHERE status IN ('queued', 'running');
+            CREATE INDEX IF NOT EXISTS idx_transcode_jobs_queue ON transcode_jobs (status, priority DESC, id);
+            CREATE INDEX IF NOT EXISTS idx_videos_channel ON videos (channel, published);
+            CREATE INDEX IF NOT EXISTS idx_videos_status ON videos (status, published);
+            CREATE INDEX IF NOT EXISTS idx_videos_published ON videos (published);
         """)
+        # Columns added after the table first shipped
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(transcode_jobs)")}
+        if "temp_paths" not in columns:
+            conn.execute("ALTER TABLE transcode_jobs ADD COLUMN temp_paths TEXT")
         conn.commit()
 
+def get_state(conn, key, default=None):
+    """Reads a value from the app_state key/value table."""
+    row = conn.execute("SELECT value FROM app_state WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+def set_state(conn, key, value):
+    """Writes a value to the app_state key/value table (caller commits)."""
+    conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)", (key, str(value)))
+
 # Retry loop for DB initialization to prevent crash on SMB lock
 while True:
     try:
@@ -81,91 +291,615 @@ while True:
 
 # Global State
 processed_videos = []
-log_buffer = []
-log_lock = threading.Lock()
-transcode_log_buffer = []
-transcode_log_lock = threading.Lock()
+tree_lock = threading.RLock()
+
+# Library version: bumped whenever scans or orphan checks change the videos table.
+# Persisted so ETags stay monotonic across restarts.
+with get_db() as conn:
+    LIBRARY_VERSION = int(get_state(conn, "library_version", 0))
+library_changed = threading.Condition()
+
+class LogBuffer:
+    """
+    Fixed-size ring buffer of log lines with global sequence numbers.
+    Sequence numbers never shift when old lines fall off, so clients can
+    resume from the last number they saw.
+    """
+
+    def __init__(self, maxlen):
+        self.entries = deque(maxlen=maxlen)
+        self.next_seq = 0
+        self.cond = threading.Condition()
+
+    def append(self, msg):
+        with self.cond:
+            self.entries.append((self.next_seq, msg))
+            self.next_seq += 1
+            self.cond.notify_all()
+
+    def since(self, seq):
+        """
+        Returns ([(seq, msg), ...] from seq on, next_seq, first available seq).
+        A seq beyond next_seq comes from before a restart and starts over.
+        """
+        with self.cond:
+            first = self.entries[0][0] if self.entries else self.next_seq
+            if seq > self.next_seq:
+                seq = first
+            skip = max(seq - first, 0)
+            return list(itertools.islice(self.entries, skip, None)), self.next_seq, first
+
+    def wait(self, seq, timeout):
+        """Blocks until a line numbered seq or later exists. Returns False on timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.next_seq > seq, timeout=timeout)
+
+log_buffer = LogBuffer(1000)
+transcode_log_buffer = LogBuffer(500)
 
 # Utility functions
+def bump_library_version():
+    """Marks the videos table as changed and wakes long-polling clients."""
+    global LIBRARY_VERSION
+    with library_changed:
+        LIBRARY_VERSION += 1
+        with get_db() as conn:
+            set_state(conn, "library_version", LIBRARY_VERSION)
+            conn.commit()
+        library_changed.notify_all()
+
 def log(msg):
     """Logs a message to stdout and the in-memory buffer."""
     print(msg, flush=True)
-    with log_lock:
-        log_buffer.append(msg)
-        if len(log_buffer) > 1000:
-            log_buffer.pop(0)
+    log_buffer.append(msg)
 
 def tlog(msg):
     """Logs a message to the transcode log buffer."""
     print(f"[TRANSCODE] {msg}", flush=True)
-    with transcode_log_lock:
-        transcode_log_buffer.append(msg)
-        if len(transcode_log_buffer) > 500:
-            transcode_log_buffer.pop(0)
+    transcode_log_buffer.append(msg)
+
+# Encoders in order of preference, with the arguments for a trial encode
+ENCODER_TRIALS = {
+    'h264_nvenc': ['-c:v', 'h264_nvenc'],
+    'h264_vaapi': ['-vaapi_device', '/dev/dri/renderD128', '-vf', 'format=nv12,hwupload', '-c:v', 'h264_vaapi'],
+    'h264_videotoolbox': ['-c:v', 'h264_videotoolbox'],
+    'libx264': ['-c:v', 'libx264', '-preset', 'ultrafast']
+}
+ENCODERS = None # Cached detection results, see detect_encoders()
+encoders_lock = threading.Lock()
 
-def detect_encoder():
-    """Detect best available hardware encoder."""
+def trial_encode(encoder):
+    """Encodes one second of a generated test pattern; returns None on success or the error."""
     import subprocess
+    args = ENCODER_TRIALS[encoder]
+    # -vaapi_device is a global option and has to come before the input
+    pre, post = (args[:2], args[2:]) if args[0] == '-vaapi_device' else ([], args)
+    cmd = ['ffmpeg', '-v', 'error', '-nostats', *pre,
+           '-f', 'lavfi', '-i', 'testsrc=size=256x256:rate=30:duration=1',
+           *post, '-f', 'null', '-']
     try:
-        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], 
-                              capture_output=True, text=True)
-        encoders = result.stdout
-        
-        if 'h264_nvenc' in encoders:
-            return 'h264_nvenc'
-        elif 'h264_vaapi' in encoders:
-            return 'h264_vaapi'
-        elif 'h264_videotoolbox' in encoders:
-            return 'h264_videotoolbox'
-        else:
-            return 'libx264'
-    except:
-        return 'libx264'
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except Exception as e:
+        return str(e)
+    if result.returncode != 0:
+        return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+    return None
+
+def detect_encoders(refresh=False):
+    """
+    Detects working H.264 encoders once and caches the result. Encoders
+    ffmpeg lists are validated with a trial encode, so one that is compiled
+    in but can't initialise (no GPU, missing driver) is never selected.
+    Returns a list of {name, listed, working, error, seconds} in preference order.
+    """
+    global ENCODERS
+    import subprocess
+    with encoders_lock:
+        if ENCODERS is not None and not refresh:
+            return ENCODERS
+        try:
+            listed = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                    capture_output=True, text=True, timeout=30).stdout
+        except Exception as e:
+            tlog(f"⚠️ Could not list ffmpeg encoders: {e}")
+            listed = ""
+        results = []
+        for name in ENCODER_TRIALS:
+            entry = {"name": name, "listed": f" {name} " in listed, "working": False, "error": None, "seconds": None}
+            if not entry["listed"]:
+                entry["error"] = "not built into ffmpeg"
+            else:
+                started = time.time()
+                entry["error"] = trial_encode(name)
+                entry["seconds"] = round(time.time() - started, 2)
+                entry["working"] = entry["error"] is None
+            results.append(entry)
+        ENCODERS = results
+        working = [e["name"] for e in results if e["working"]]
+        tlog(f"🎛️ Working encoders: {', '.join(working) or 'none'}")
+        return ENCODERS
+
+def detect_encoder():
+    """Best working encoder from the cached detection (libx264 if nothing passed)."""
+    for entry in detect_encoders():
+        if entry["working"]:
+            return entry["name"]
+    return 'libx264'
+
+def parse_probe(data):
+    """Condenses ffprobe's JSON output into the fields the transcoder uses."""
+    streams = data.get("streams") or []
+    fmt = data.get("format") or {}
+    video = [st for st in streams if st.get("codec_type") == "video"
+             and not (st.get("disposition") or {}).get("attached_pic")]
+    audio = [st for st in streams if st.get("codec_type") == "audio"]
+    first_video = video[0] if video else {}
+
+    def number(value, cast=float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "video_codec": first_video.get("codec_name"),
+        "audio_codec": audio[0].get("codec_name") if audio else None,
+        "width": first_video.get("width"),
+        "height": first_video.get("height"),
+        "bitrate": number(fmt.get("bit_rate"), int),
+        "duration": number(fmt.get("duration")),
+        "container": fmt.get("format_name"),
+        "video_streams": len(video),
+        "audio_streams": len(audio)
+    }
 
-def probe_codecs(filepath):
-    """Probe video and audio codecs using ffprobe."""
+def probe_file(filepath, cache=True):
+    """
+    Probes a file with a single ffprobe call and caches the parsed result in
+    SQLite keyed by (path, size, mtime), so unchanged files are never probed
+    twice. Returns the parsed dict, or None if the file can't be read.
+    Probe errors are cached too (as {"error": ...}) and returned as None.
+    Pass cache=False for throwaway files such as encoder output.
+    """
     import subprocess
     try:
-        # Get video codec
-        v_result = subprocess.run([
-            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-            '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', filepath
-        ], capture_output=True, text=True)
-        video_codec = v_result.stdout.strip()
-        
-        # Get audio codec
-        a_result = subprocess.run([
-            'ffprobe', '-v', 'error', '-select_streams', 'a:0',
-            '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', filepath
-        ], capture_output=True, text=True)
-        audio_codec = a_result.stdout.strip()
-        
-        return video_codec, audio_codec
+        st = os.stat(filepath)
+    except OSError as e:
+        tlog(f"Error probing {filepath}: {e}")
+        return None
+
+    row = None
+    if cache:
+        with get_db() as conn:
+            row = conn.execute(
+                "SELECT data FROM probe_cache WHERE path = ? AND size = ? AND mtime = ?",
+                (str(filepath), st.st_size, st.st_mtime)
+            ).fetchone()
+    if row:
+        info = json.loads(row["data"])
+        return None if "error" in info else info
+
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', str(filepath)
+        ], capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            info = {"error": result.stderr.strip() or f"ffprobe exit code {result.returncode}"}
+        else:
+            info = parse_probe(json.loads(result.stdout or "{}"))
     except Exception as e:
+        # Timeouts and missing ffprobe are not cached: they say nothing about the file
         tlog(f"Error probing {filepath}: {e}")
-        return None, None
+        return None
 
-def transcode_video(filepath, encoder='libx264'):
-    """Transcode a video file to H.264/AAC."""
+    if cache:
+        with get_db() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO probe_cache (path, size, mtime, data) VALUES (?, ?, ?, ?)",
+                (str(filepath), st.st_size, st.st_mtime, json.dumps(info))
+            )
+            conn.commit()
+    if "error" in info:
+        tlog(f"Error probing {filepath}: {info['error']}")
+        return None
+    return info
+
+def decide_action(info):
+    """
+    Picks the cheapest action that makes a file match the target profile:
+    'noop' (already fine), 'remux' (copy streams into MP4), 'audio'
+    (re-encode audio only), 'full' (re-encode video), or 'error' if the
+    probe failed or found no video.
+    """
+    if not info or not info.get("video_codec"):
+        return "error"
+    if info["video_codec"] not in TRANSCODE_TARGET_VIDEO:
+        return "full"
+    if info["audio_codec"] and info["audio_codec"] not in TRANSCODE_TARGET_AUDIO:
+        return "audio"
+    if not TRANSCODE_TARGET_CONTAINERS & set((info.get("container") or "").split(",")):
+        return "remux"
+    return "noop"
+
+job_progress = {} # job_id -> latest ffmpeg progress snapshot
+
+def parse_out_time(value):
+    """Parses ffmpeg's HH:MM:SS.micro out_time into seconds."""
+    try:
+        h, m, sec = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    except (AttributeError, ValueError):
+        return None
+
+def progress_snapshot(fields, duration, started):
+    """Turns one block of `-progress` key=value pairs into the per-job status shown in the UI."""
+    out_time = parse_out_time(fields.get("out_time"))
+    try:
+        speed = float(fields.get("speed", "").rstrip("x"))
+    except ValueError:
+        speed = None
+    try:
+        fps = float(fields.get("fps", ""))
+    except ValueError:
+        fps = None
+    snapshot = {
+        "frame": int(fields["frame"]) if fields.get("frame", "").isdigit() else None,
+        "fps": fps,
+        "speed": speed,
+        "out_time": out_time,
+        "duration": duration,
+        "percent": None,
+        "eta": None,
+        "elapsed": round(time.time() - started, 1)
+    }
+    if duration and out_time is not None:
+        snapshot["percent"] = round(min(out_time / duration, 1.0) * 100, 1)
+        if speed:
+            snapshot["eta"] = round(max(duration - out_time, 0) / speed, 1)
+    return snapshot
+
+def priority_prefix():
+    """nice/ionice wrapper for ffmpeg commands. Both exec the command, so the PID is ffmpeg's."""
+    prefix = []
+    if TRANSCODE_NICE and shutil.which("nice"):
+        prefix += ["nice", "-n", str(TRANSCODE_NICE)]
+    if TRANSCODE_IONICE and shutil.which("ionice"):
+        prefix += ["ionice", "-c", {"idle": "3", "best-effort": "2"}.get(TRANSCODE_IONICE, TRANSCODE_IONICE)]
+    return prefix
+
+def run_ffmpeg(cmd, job_id=None, duration=None, on_progress=None):
+    """
+    Runs an ffmpeg command. While it runs, the process is registered under
+    its job so cancel_transcode_job() can terminate it, and `-progress pipe:1`
+    output on stdout is parsed into job_progress as it arrives (or handed to
+    on_progress instead). The returned CompletedProcess carries wall_seconds
+    and cpu_seconds.
+    """
+    import subprocess
+    started = time.time()
+    if job_id is not None and job_id in cancelled_jobs:
+        result = subprocess.CompletedProcess(cmd, -signal.SIGTERM, "", "cancelled")
+        result.wall_seconds, result.cpu_seconds = 0, None
+        return result
+    proc = subprocess.Popen(priority_prefix() + cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if job_id is not None:
+        with transcode_lock:
+            running_procs.setdefault(job_id, set()).add(proc)
+            # A cancel between the check above and registering would miss this process
+            if job_id in cancelled_jobs:
+                proc.terminate()
+
+    # Drain stderr on the side so a chatty ffmpeg can't block on a full pipe
+    stderr_lines = deque(maxlen=200)
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(proc.stderr), daemon=True)
+    stderr_thread.start()
+
+    cpu_seconds = None
+    try:
+        fields = {}
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key != "progress":
+                fields[key] = value
+                continue
+            if on_progress:
+                on_progress(progress_snapshot(fields, duration, started))
+            elif job_id is not None:
+                job_progress[job_id] = progress_snapshot(fields, duration, started)
+            fields = {}
+        stderr_thread.join()
+        try:
+            # Reap the child ourselves to get its CPU time
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            cpu_seconds = usage.ru_utime + usage.ru_stime
+        except ChildProcessError:
+            proc.wait()
+    finally:
+        if job_id is not None:
+            with transcode_lock:
+                procs = running_procs.get(job_id, set())
+                procs.discard(proc)
+                if not procs:
+                    running_procs.pop(job_id, None)
+            if not on_progress:
+                job_progress.pop(job_id, None)
+    result = subprocess.CompletedProcess(cmd, proc.returncode, "", "".join(stderr_lines))
+    result.wall_seconds = time.time() - started
+    result.cpu_seconds = cpu_seconds
+    return result
+
+def record_decision(filepath, info, input_size):
+    """Records a file that needed no work, so the savings report can count it."""
+    with get_db() as conn:
+        conn.execute("""
+            INSERT INTO transcode_stats (filepath, encoder, mode, duration, wall_seconds, cpu_seconds,
+                                         speed, input_size, output_size)
+            VALUES (?, 'none', 'noop', ?, 0, 0, NULL, ?, ?)
+        """, (str(filepath), info.get("duration"), input_size, input_size))
+        conn.commit()
+
+def record_transcode_stats(job_id, filepath, encoder, mode, result, duration, input_size, output_path):
+    """Stores throughput for a finished encode so encoders can be compared on this hardware."""
+    try:
+        output_size = os.path.getsize(output_path)
+    except OSError:
+        output_size = None
+    speed = duration / result.wall_seconds if duration and result.wall_seconds else None
+    with get_db() as conn:
+        conn.execute("""
+            INSERT INTO transcode_stats (job_id, filepath, encoder, mode, duration, wall_seconds,
+                                         cpu_seconds, speed, input_size, output_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (job_id, str(filepath), encoder, mode, duration, result.wall_seconds,
+              result.cpu_seconds, speed, input_size, output_size))
+        conn.commit()
+    speed_text = f"{speed:.2f}x" if speed else "n/a"
+    tlog(f"📊 {encoder} {mode}: {result.wall_seconds:.0f}s wall, speed {speed_text}")
+
+def verify_output(source_info, output_path):
+    """
+    Checks an encode before it replaces the original: one video stream,
+    audio kept if the source had any, and a duration within 1% (or 2s) of
+    the source. Returns a problem description, or None if the output is good.
+    """
+    out = probe_file(output_path, cache=False)
+    if not out:
+        return "output can't be probed"
+    if out["video_streams"] != 1:
+        return f"expected 1 video stream, found {out['video_streams']}"
+    if out["audio_streams"] != min(source_info.get("audio_streams") or 0, 1):
+        return f"expected {min(source_info.get('audio_streams') or 0, 1)} audio streams, found {out['audio_streams']}"
+    expected, actual = source_info.get("duration"), out["duration"]
+    if expected and (actual is None or abs(actual - expected) > max(2.0, expected * 0.01)):
+        return f"duration {actual}s does not match source {expected}s"
+    return None
+
+def chunk_worker_count():
+    return TRANSCODE_CHUNK_WORKERS or max(1, (os.cpu_count() or 1) // 4)
+
+def transcode_chunked(filepath, temp_file, job_id=None, duration=None):
+    """
+    Segment-parallel libx264 encode for long videos. The video stream is
+    split losslessly at keyframes, the segments are encoded by a pool of
+    ffmpeg processes and concatenated without re-encoding, and the audio is
+    encoded once from the original while muxing. Returns a CompletedProcess
+    like run_ffmpeg(), with wall and CPU time summed over every step.
+    """
     import subprocess
+    started = time.time()
+    workdir = Path(f"{temp_file}.chunks")
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+    cpu_seconds = 0.0
+
+    def step(cmd, on_progress=None, seg_duration=None):
+        nonlocal cpu_seconds
+        result = run_ffmpeg(cmd, job_id, seg_duration, on_progress or (lambda snapshot: None))
+        cpu_seconds += result.cpu_seconds or 0
+        return result
+
+    def failed(result, what):
+        result = subprocess.CompletedProcess(result.args, result.returncode or 1, "", f"{what}: {result.stderr}")
+        result.wall_seconds, result.cpu_seconds = time.time() - started, cpu_seconds
+        return result
+
+    try:
+        split = step([
+            'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
+            '-map', '0:v:0', '-c', 'copy', '-an',
+            '-f', 'segment', '-segment_time', str(TRANSCODE_CHUNK_SECONDS), '-reset_timestamps', '1',
+            str(workdir / 'src%05d.mkv')
+        ])
+        if split.returncode != 0:
+            return failed(split, "split failed")
+        segments = sorted(workdir.glob('src*.mkv'))
+        workers = min(chunk_worker_count(), len(segments))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        tlog(f"🧩 Chunked encode: {len(segments)} segments, {workers} encoders x {threads} threads")
+
+        done_seconds = {}
+        def segment_progress(seg):
+            def update(snapshot):
+                done_seconds[seg] = snapshot["out_time"] or 0
+                snapshot = dict(snapshot, out_time=sum(done_seconds.values()), duration=duration)
+                if duration:
+                    elapsed = time.time() - started
+                    snapshot["percent"] = round(min(snapshot["out_time"] / duration, 1.0) * 100, 1)
+                    snapshot["speed"] = round(snapshot["out_time"] / elapsed, 2) if elapsed else None
+                    snapshot["eta"] = (round((duration - snapshot["out_time"]) / snapshot["speed"], 1)
+                                       if snapshot["speed"] else None)
+                if job_id is not None:
+                    job_progress[job_id] = snapshot
+            return update
+
+        def encode(seg):
+            if job_id in cancelled_jobs:
+                return None
+            return step([
+                'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', str(seg),
+                '-c:v', 'libx264', '-crf', '23', '-preset', 'medium', '-threads', str(threads),
+                '-an', '-y', str(seg.with_name(seg.name.replace('src', 'enc')))
+            ], segment_progress(seg))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(encode, segments))
+        for result in results:
+            if result is None or result.returncode != 0:
+                return failed(result or subprocess.CompletedProcess([], 1, "", ""), "segment encode failed")
+
+        concat_list = workdir / 'concat.txt'
+        concat_list.write_text("".join(
+            f"file '{seg.with_name(seg.name.replace('src', 'enc')).name}'\n" for seg in segments
+        ))
+        mux = step([
+            'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1',
+            '-f', 'concat', '-safe', '0', '-i', str(concat_list), '-i', filepath,
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy',
+            '-c:a', 'aac', '-b:a', '192k',
+            '-movflags', '+faststart',
+            '-y', temp_file
+        ])
+        if mux.returncode != 0:
+            return failed(mux, "concat failed")
+        result = subprocess.CompletedProcess(mux.args, 0, "", mux.stderr)
+        result.wall_seconds, result.cpu_seconds = time.time() - started, cpu_seconds
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if job_id is not None:
+            job_progress.pop(job_id, None)
+
+SCRATCH_PREFIX = "ta-transcode-"
+scratch_reserved = {} # temp path -> bytes set aside in the scratch dir for a running encode
+scratch_lock = threading.Lock()
+
+def scratch_path(filepath, input_size, job_id=None, chunked=False):
+    """
+    Picks where an encode writes its output: TRANSCODE_SCRATCH_DIR when it
+    has room for the job (chunked encodes also hold the split segments),
+    otherwise next to the source as before. Space promised to encodes that
+    are still running counts as used; release_scratch() gives it back.
+    """
+    fallback = f"{filepath}.temp.mp4"
+    if not TRANSCODE_SCRATCH_DIR:
+        return fallback
+    scratch = Path(TRANSCODE_SCRATCH_DIR)
+    try:
+        scratch.mkdir(parents=True, exist_ok=True)
+        free = shutil.disk_usage(scratch).free
+    except OSError as e:
+        tlog(f"⚠️ Scratch dir unusable ({e}), writing next to the source")
+        return fallback
+    job_bytes = int(input_size * (3 if chunked else 1.5))
+    needed = job_bytes + TRANSCODE_SCRATCH_RESERVE_MB * 1024 * 1024
+    with scratch_lock:
+        free -= sum(scratch_reserved.values())
+        if free < needed:
+            tlog(f"⚠️ Scratch dir has {max(free, 0) // 2**20} MB unreserved, job needs ~{needed // 2**20} MB; writing next to the source")
+            return fallback
+        temp_file = str(scratch / f"{SCRATCH_PREFIX}{job_id or 0}-{int(time.time() * 1000)}.mp4")
+        scratch_reserved[temp_file] = job_bytes
+    return temp_file
+
+def release_scratch(temp_file):
+    with scratch_lock:
+        scratch_reserved.pop(temp_file, None)
+
+def install_output(temp_file, filepath):
+    """
+    Moves a finished encode over the original. Output on another filesystem
+    (the scratch dir) is copied back to a sibling of the original, then
+    renamed over it, so the swap itself is atomic.
+    """
+    try:
+        os.replace(temp_file, filepath)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    staging = f"{filepath}.temp.mp4"
+    size = os.path.getsize(temp_file)
+    if shutil.disk_usage(os.path.dirname(filepath)).free < size:
+        raise OSError(errno.ENOSPC, f"Not enough space next to {filepath} for {size // 2**20} MB")
+    copy_file(temp_file, filepath, link=False, part=staging)
+    os.unlink(temp_file)
+
+def note_temp_paths(job_id, paths):
+    """Records a job's temp files so a restart can clean up after an interrupted encode."""
+    if job_id is None:
+        return
+    with get_db() as conn:
+        conn.execute("UPDATE transcode_jobs SET temp_paths = ? WHERE id = ?", (json.dumps(paths), job_id))
+        conn.commit()
+
+def cleanup_transcode_temp():
+    """Removes temp files left by jobs interrupted mid-encode and empties our part of the scratch dir."""
+    removed = 0
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT id, temp_paths FROM transcode_jobs WHERE status = 'running' AND temp_paths IS NOT NULL"
+        ).fetchall()
+        for row in rows:
+            for path in json.loads(row["temp_paths"]):
+                for leftover in (path, f"{path}.chunks"):
+                    if os.path.isdir(leftover):
+                        shutil.rmtree(leftover, ignore_errors=True)
+                        removed += 1
+                    elif os.path.exists(leftover):
+                        try:
+                            os.unlink(leftover)
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+        conn.execute("UPDATE transcode_jobs SET temp_paths = NULL WHERE status = 'running'")
+        conn.commit()
+    if TRANSCODE_SCRATCH_DIR and os.path.isdir(TRANSCODE_SCRATCH_DIR):
+        with os.scandir(TRANSCODE_SCRATCH_DIR) as it:
+            for entry in it:
+                if not entry.name.startswith(SCRATCH_PREFIX):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        continue
+                removed += 1
+    # Nothing is encoding yet, so no scratch space is spoken for
+    with scratch_lock:
+        scratch_reserved.clear()
+    if removed:
+        tlog(f"🧹 Removed {removed} leftover transcode temp files")
+
+def transcode_video(filepath, encoder='libx264', job_id=None):
+    """Transcode a video file to H.264/AAC."""
     
     original_path = Path(filepath)
     
     # Try to resolve symlink first (don't check if it exists, broken symlinks still exist as links)
     if original_path.is_symlink():
         try:
-            actual_file = Path(os.readlink(original_path)).resolve()
-            tlog(f"Following symlink: {filepath} -> {actual_file}")
+            link_target = Path(os.readlink(original_path))
+            tlog(f"Following symlink: {filepath} -> {link_target}")
             
-            # Translate host path to container path
-            # Host: /mnt/user/tubearchives/bp/... → Container: /app/source/...
-            actual_file_str = str(actual_file)
-            if actual_file_str.startswith("/mnt/user/tubearchives/bp"):
-                container_path = actual_file_str.replace("/mnt/user/tubearchives/bp", "/app/source", 1)
-                tlog(f"Translated path: {actual_file} -> {container_path}")
-                filepath = container_path
+            # Prefer the source index: it already knows where the file lives in the container
+            entry = SOURCE_INDEX.get(link_target.stem)
+            if entry and entry["path"].exists():
+                filepath = str(entry["path"])
+                tlog(f"Indexed path: {link_target} -> {filepath}")
             else:
-                filepath = str(actual_file)
+                # Translate host path to container path
+                # Host: /mnt/user/tubearchives/bp/... → Container: /app/source/...
+                actual_file = link_target.resolve()
+                try:
+                    container_path = SOURCE_DIR / actual_file.relative_to(HOST_SOURCE_DIR)
+                    tlog(f"Translated path: {actual_file} -> {container_path}")
+                    filepath = str(container_path)
+                except ValueError:
+                    filepath = str(actual_file)
         except Exception as e:
             tlog(f"Error resolving symlink: {e}")
             return False
@@ -178,20 +912,38 @@ def transcode_video(filepath, encoder='libx264'):
         tlog(f"Source file not found: {filepath}")
         return False
     
-    video_codec, audio_codec = probe_codecs(filepath)
+    source_info = probe_file(filepath)
+    mode = decide_action(source_info)
+    input_size = os.path.getsize(filepath)
     
-    if video_codec == 'h264' and audio_codec == 'aac':
-        tlog(f"Already H.264/AAC: {filepath}")
+    if mode == 'error':
+        tlog(f"❌ Can't probe a video stream in {filepath}")
+        return False
+    if mode == 'noop':
+        tlog(f"Already matches target profile: {filepath}")
+        record_decision(filepath, source_info, input_size)
         return True
     
-    temp_file = f"{filepath}.temp.mp4"
+    duration = source_info.get("duration")
+    chunked = (mode == 'full' and encoder == 'libx264' and TRANSCODE_CHUNKED
+               and (duration or 0) >= TRANSCODE_CHUNK_MIN_DURATION)
+    temp_file = scratch_path(filepath, input_size, job_id, chunked)
+    note_temp_paths(job_id, sorted({temp_file, f"{filepath}.temp.mp4"}))
     
     try:
         # Determine transcode strategy
-        if video_codec == 'h264':
+        if mode == 'remux':
+            tlog(f"Remux to MP4: {filepath}")
+            cmd = [
+                'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
+                '-c', 'copy', '-sn',
+                '-movflags', '+faststart',
+                '-y', temp_file
+            ]
+        elif mode == 'audio':
             tlog(f"Audio-only transcode: {filepath}")
             cmd = [
-                'ffmpeg', '-v', 'error', '-stats', '-i', filepath,
+                'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
                 '-c:v', 'copy',
                 '-c:a', 'aac', '-b:a', '192k',
                 '-movflags', '+faststart',
@@ -201,7 +953,7 @@ def transcode_video(filepath, encoder='libx264'):
             tlog(f"Full transcode using {encoder}: {filepath}")
             if encoder == 'h264_nvenc':
                 cmd = [
-                    'ffmpeg', '-v', 'error', '-stats', '-i', filepath,
+                    'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
                     '-c:v', 'h264_nvenc', '-preset', 'fast', '-cq', '23',
                     '-c:a', 'aac', '-b:a', '192k',
                     '-movflags', '+faststart',
@@ -209,7 +961,7 @@ def transcode_video(filepath, encoder='libx264'):
                 ]
             elif encoder == 'h264_vaapi':
                 cmd = [
-                    'ffmpeg', '-v', 'error', '-stats',
+                    'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1',
                     '-hwaccel', 'vaapi', '-hwaccel_output_format', 'vaapi',
                     '-i', filepath,
                     '-vf', 'format=nv12,hwupload',
@@ -218,128 +970,704 @@ def transcode_video(filepath, encoder='libx264'):
                     '-movflags', '+faststart',
                     '-y', temp_file
                 ]
+            elif encoder == 'h264_videotoolbox':
+                cmd = [
+                    'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
+                    '-c:v', 'h264_videotoolbox', '-b:v', '5M',
+                    '-c:a', 'aac', '-b:a', '192k',
+                    '-movflags', '+faststart',
+                    '-y', temp_file
+                ]
             else:  # libx264
                 cmd = [
-                    'ffmpeg', '-v', 'error', '-stats', '-i', filepath,
+                    'ffmpeg', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', filepath,
                     '-c:v', 'libx264', '-crf', '23', '-preset', 'medium',
                     '-c:a', 'aac', '-b:a', '192k',
                     '-movflags', '+faststart',
                     '-y', temp_file
                 ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        if chunked:
+            result = transcode_chunked(filepath, temp_file, job_id, duration)
+        else:
+            result = run_ffmpeg(cmd, job_id, duration)
+        
+        if result.returncode == 0:
+            problem = verify_output(source_info, temp_file)
+            if problem:
+                result.returncode, result.stderr = 1, f"verification failed: {problem}"
+        
+        if result.returncode == 0 and job_id in cancelled_jobs:
+            tlog(f"⏹️ Cancelled before replacing: {filepath}")
+            Path(temp_file).unlink(missing_ok=True)
+            return False
         
         if result.returncode == 0:
+            record_transcode_stats(job_id, filepath, encoder if mode == 'full' else 'copy',
+                                   mode, result, duration, input_size, temp_file)
             # Replace original
-            Path(filepath).unlink()
-            Path(temp_file).rename(filepath)
+            if TRANSCODE_RENAME_EXTENSION and Path(filepath).suffix.lower() != '.mp4':
+                renamed = str(Path(filepath).with_suffix('.mp4'))
+                install_output(temp_file, renamed)
+                os.unlink(filepath)
+                tlog(f"✅ Success: {filepath} -> {renamed}")
+                # Point the library link at the new name
+                sync_video_ids(set(), channel_paths=[str(Path(renamed).parent)])
+                return True
+            install_output(temp_file, filepath)
             tlog(f"✅ Success: {filepath}")
             return True
         else:
-            # Check if it's a GPU error and retry with CPU
-            if encoder in ['h264_nvenc', 'h264_vaapi', 'h264_videotoolbox'] and 'libcuda' in result.stderr or 'Cannot load' in result.stderr:
-                tlog(f"⚠️ GPU encoding failed, retrying with CPU (libx264)...")
-                
-                # Retry with libx264
-                if video_codec == 'h264':
-                    cpu_cmd = [
-                        'ffmpeg', '-v', 'error', '-stats', '-i', filepath,
-                        '-c:v', 'copy',
-                        '-c:a', 'aac', '-b:a', '192k',
-                        '-movflags', '+faststart',
-                        '-y', temp_file
-                    ]
-                else:
-                    cpu_cmd = [
-                        'ffmpeg', '-v', 'error', '-stats', '-i', filepath,
-                        '-c:v', 'libx264', '-crf', '23', '-preset', 'medium',
-                        '-c:a', 'aac', '-b:a', '192k',
-                        '-movflags', '+faststart',
-                        '-y', temp_file
-                    ]
-                
-                cpu_result = subprocess.run(cpu_cmd, capture_output=True, text=True)
-                
-                if cpu_result.returncode == 0:
-                    Path(filepath).unlink()
-                    Path(temp_file).rename(filepath)
-                    tlog(f"✅ Success (CPU): {filepath}")
-                    return True
-                else:
-                    tlog(f"❌ Failed (CPU): {filepath}")
-                    tlog(f"Error: {cpu_result.stderr}")
-                    if Path(temp_file).exists():
-                        Path(temp_file).unlink()
-                    return False
-            else:
-                tlog(f"❌ Failed: {filepath}")
-                tlog(f"Error: {result.stderr}")
-                if Path(temp_file).exists():
-                    Path(temp_file).unlink()
-                return False
+            tlog(f"❌ Failed: {filepath}")
+            tlog(f"Error: {result.stderr}")
+            if Path(temp_file).exists():
+                Path(temp_file).unlink()
+            return False
             
     except Exception as e:
         tlog(f"❌ Exception: {e}")
         if Path(temp_file).exists():
             Path(temp_file).unlink()
         return False
+    finally:
+        release_scratch(temp_file)
+
+# Transcode job queue
+# Jobs live in SQLite so they survive restarts; a fixed pool of worker
+# threads runs them one ffmpeg at a time each.
+
+transcode_lock = threading.RLock()
+transcode_queue_changed = threading.Condition(transcode_lock)
+running_procs = {} # job_id -> set of ffmpeg Popens
+cancelled_jobs = set()
+
+def transcode_worker_count(encoder):
+    """Workers to run: hardware encoders handle a couple of sessions, libx264 is CPU bound."""
+    if TRANSCODE_WORKERS > 0:
+        return TRANSCODE_WORKERS
+    if encoder != 'libx264':
+        return 2
+    # libx264 already spreads one encode over ~8 threads
+    return max(1, (os.cpu_count() or 1) // 8)
+
+def enqueue_transcode(filepath, priority=0):
+    """
+    Queues a file for transcoding. A file that is already queued or running
+    is not queued twice. Returns (job_id, created).
+    """
+    filepath = os.path.normpath(filepath)
+    with get_db() as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO transcode_jobs (filepath, priority) VALUES (?, ?)",
+            (filepath, priority)
+        )
+        conn.commit()
+        if cur.rowcount:
+            job_id, created = cur.lastrowid, True
+        else:
+            row = conn.execute(
+                "SELECT id FROM transcode_jobs WHERE filepath = ? AND status IN ('queued', 'running')",
+                (filepath,)
+            ).fetchone()
+            job_id, created = row["id"], False
+    if created:
+        with transcode_queue_changed:
+            transcode_queue_changed.notify()
+    return job_id, created
+
+BULK_PRIORITY = 0 # Jobs at or below this priority (enqueue-all) wait for the bulk window
+THROTTLE = {"state": "running", "reason": None, "since": None}
+
+bad_windows = set() # Window specs already reported as unparseable
+
+def in_window(spec, now=None):
+    """True if now falls in any 'HH:MM-HH:MM' range of a comma-separated spec (ranges may wrap midnight)."""
+    if not spec.strip():
+        return True
+    now = (now or datetime.now()).time().replace(second=0, microsecond=0)
+    for window in spec.split(","):
+        try:
+            start, end = [datetime.strptime(part.strip(), "%H:%M").time() for part in window.split("-")]
+        except ValueError:
+            if window not in bad_windows:
+                bad_windows.add(window)
+                tlog(f"⚠️ Ignoring bad time window '{window.strip()}', expected HH:MM-HH:MM")
+            continue
+        if (start <= now < end) if start <= end else (now >= start or now < end):
+            return True
+    return False
+
+def transcode_gate():
+    """
+    Decides what the workers may start right now: nothing while the load
+    average is above TRANSCODE_MAX_LOAD, only manual jobs outside the bulk
+    window, everything otherwise. Transitions are logged and kept in THROTTLE.
+    """
+    load = os.getloadavg()[0] if hasattr(os, "getloadavg") else 0.0
+    if TRANSCODE_MAX_LOAD and load > TRANSCODE_MAX_LOAD:
+        state, reason, gate = "paused", f"load {load:.1f} > {TRANSCODE_MAX_LOAD:g}", (False, False)
+    elif not in_window(TRANSCODE_BULK_WINDOW):
+        state, reason, gate = "manual-only", f"outside bulk window {TRANSCODE_BULK_WINDOW}", (True, False)
+    else:
+        state, reason, gate = "running", None, (True, True)
+    if state != THROTTLE["state"]:
+        THROTTLE.update(state=state, reason=reason, since=datetime.now().isoformat())
+        tlog(f"⏸️ Transcodes {state}: {reason}" if reason else "▶️ Transcodes resumed")
+    THROTTLE["load"] = round(load, 2)
+    return gate
+
+def claim_transcode_job(bulk=True):
+    """
+    Marks the highest-priority queued job as running and returns it (or None).
+    With bulk=False only manual jobs (priority above BULK_PRIORITY) are claimed.
+    """
+    with transcode_lock, get_db() as conn:
+        row = conn.execute(
+            "SELECT * FROM transcode_jobs WHERE status = 'queued'"
+            + ("" if bulk else f" AND priority > {BULK_PRIORITY}")
+            + " ORDER BY priority DESC, id LIMIT 1"
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE transcode_jobs SET status = 'running', attempts = attempts + 1, started = CURRENT_TIMESTAMP, error = NULL WHERE id = ?",
+            (row["id"],)
+        )
+        conn.commit()
+        return dict(row)
+
+def finish_transcode_job(job_id, status, error=None, encoder=None):
+    """Records a job's final state."""
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE transcode_jobs SET status = ?, error = ?, encoder = COALESCE(?, encoder), finished = CURRENT_TIMESTAMP, temp_paths = NULL WHERE id = ?",
+            (status, error, encoder, job_id)
+        )
+        conn.commit()
+
+def cancel_transcode_job(job_id):
+    """Cancels a queued job, or terminates the ffmpeg of a running one."""
+    with transcode_lock, get_db() as conn:
+        row = conn.execute("SELECT status FROM transcode_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row or row["status"] not in ("queued", "running"):
+            return False
+        if row["status"] == "queued":
+            conn.execute("UPDATE transcode_jobs SET status = 'cancelled', finished = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+            conn.commit()
+        else:
+            cancelled_jobs.add(job_id)
+            for proc in running_procs.get(job_id, ()):
+                proc.terminate()
+    return True
+
+def retry_transcode_job(job_id):
+    """Puts a failed or cancelled job back in the queue."""
+    with transcode_lock, get_db() as conn:
+        row = conn.execute("SELECT filepath, status FROM transcode_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row or row["status"] not in ("failed", "cancelled"):
+            return False
+        active = conn.execute(
+            "SELECT 1 FROM transcode_jobs WHERE filepath = ? AND status IN ('queued', 'running')", (row["filepath"],)
+        ).fetchone()
+        if active:
+            return False
+        conn.execute("UPDATE transcode_jobs SET status = 'queued', error = NULL, finished = NULL WHERE id = ?", (job_id,))
+        conn.commit()
+        transcode_queue_changed.notify()
+    return True
+
+def transcode_worker(worker_id):
+    while True:
+        with transcode_queue_changed:
+            run, bulk = transcode_gate()
+            job = claim_transcode_job(bulk) if run else None
+            if not job:
+                transcode_queue_changed.wait(timeout=30)
+                continue
+
+        encoder = detect_encoder()
+        tlog(f"▶️ Job {job['id']} (worker {worker_id}, {encoder}): {job['filepath']}")
+        try:
+            ok = transcode_video(job["filepath"], encoder, job_id=job["id"])
+            error = None if ok else "Transcode failed, see logs"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        with transcode_lock:
+            was_cancelled = job["id"] in cancelled_jobs
+            cancelled_jobs.discard(job["id"])
+        # A cancel that arrived after the output was installed can't be undone: the job is done
+        if ok:
+            finish_transcode_job(job["id"], "done", encoder=encoder)
+            refresh_media_info(job["filepath"])
+        elif was_cancelled:
+            finish_transcode_job(job["id"], "cancelled", encoder=encoder)
+            tlog(f"⏹️ Job {job['id']} cancelled")
+        elif job["attempts"] + 1 < TRANSCODE_MAX_ATTEMPTS:
+            with get_db() as conn:
+                conn.execute("UPDATE transcode_jobs SET status = 'queued', error = ? WHERE id = ?", (error, job["id"]))
+                conn.commit()
+            tlog(f"🔁 Job {job['id']} failed, retrying ({job['attempts'] + 1}/{TRANSCODE_MAX_ATTEMPTS})")
+        else:
+            finish_transcode_job(job["id"], "failed", error=error, encoder=encoder)
+
+def start_transcode_workers():
+    """Cleans up after and requeues jobs interrupted by a restart, then starts the worker pool."""
+    cleanup_transcode_temp()
+    with get_db() as conn:
+        requeued = conn.execute("UPDATE transcode_jobs SET status = 'queued' WHERE status = 'running'").rowcount
+        conn.commit()
+    if requeued:
+        tlog(f"🔁 Requeued {requeued} jobs interrupted by restart")
+    workers = transcode_worker_count(detect_encoder())
+    for worker_id in range(workers):
+        threading.Thread(target=transcode_worker, args=(worker_id + 1,), daemon=True).start()
+    tlog(f"🧵 Started {workers} transcode workers")
+
+# Transcode candidate discovery
+DISCOVERY = {
+    "status": "idle", # idle, running, done, error
+    "total": 0,
+    "probed": 0,
+    "cached": 0,
+    "errors": 0,
+    "started": None,
+    "finished": None,
+    "error": None
+}
+discovery_lock = threading.Lock()
+
+def media_info_row(video_id, entry, info):
+    action = decide_action(info)
+    info = info or {}
+    return (
+        video_id, str(entry["path"]), entry["channel"], entry["size"], entry["mtime"],
+        info.get("video_codec"), info.get("audio_codec"), info.get("width"), info.get("height"),
+        info.get("bitrate"), info.get("duration"), info.get("container"), action
+    )
+
+def store_media_info(conn, rows):
+    """Upserts media_info rows (caller commits)."""
+    for chunk in chunked(rows, DB_BATCH_SIZE):
+        conn.executemany("""
+            INSERT INTO media_info (video_id, path, channel, size, mtime, video_codec, audio_codec,
+                                    width, height, bitrate, duration, container, action)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                path = excluded.path, channel = excluded.channel, size = excluded.size,
+                mtime = excluded.mtime, video_codec = excluded.video_codec,
+                audio_codec = excluded.audio_codec, width = excluded.width, height = excluded.height,
+                bitrate = excluded.bitrate, duration = excluded.duration,
+                container = excluded.container, action = excluded.action,
+                probed_at = CURRENT_TIMESTAMP
+        """, chunk)
+
+def reclassify_media_info(conn):
+    """Re-applies decide_action() to stored probe data, so a changed target profile needs no re-probe."""
+    updates = []
+    for row in conn.execute("SELECT video_id, video_codec, audio_codec, container, action FROM media_info"):
+        action = decide_action(dict(row))
+        if action != row["action"]:
+            updates.append((action, row["video_id"]))
+    conn.executemany("UPDATE media_info SET action = ? WHERE video_id = ?", updates)
+
+def discover_transcode_candidates():
+    """
+    Probes every file in the source library with a bounded pool of ffprobe
+    processes and records codec info per video in media_info. Files whose
+    size and mtime haven't changed since the last run are skipped, except
+    unreadable ones: a timeout or missing ffprobe isn't cached, so those get
+    another try, while real ffprobe failures come back from the probe cache.
+    """
+    with discovery_lock:
+        if DISCOVERY["status"] == "running":
+            return False
+        DISCOVERY.update(status="running", total=0, probed=0, cached=0, errors=0,
+                         started=datetime.now().isoformat(), finished=None, error=None)
+    try:
+        index = build_source_index()
+        with get_db() as conn:
+            known = {row["video_id"]: (row["path"], row["size"], row["mtime"]) for row in
+                     conn.execute("SELECT video_id, path, size, mtime FROM media_info WHERE action != 'error'")}
+            known_ids = {row["video_id"] for row in conn.execute("SELECT video_id FROM media_info")}
+            # Forget files that left the library
+            gone = [(vid,) for vid in known_ids if vid not in index]
+            conn.executemany("DELETE FROM media_info WHERE video_id = ?", gone)
+            conn.commit()
+
+        todo = [(vid, entry) for vid, entry in index.items()
+                if known.get(vid) != (str(entry["path"]), entry["size"], entry["mtime"])]
+        DISCOVERY["total"] = len(index)
+        DISCOVERY["cached"] = len(index) - len(todo)
+        tlog(f"🔎 Discovery: {len(todo)} of {len(index)} files need probing ({PROBE_WORKERS} workers)")
+
+        rows = []
+        with ThreadPoolExecutor(max_workers=max(1, PROBE_WORKERS)) as pool:
+            futures = {pool.submit(probe_file, entry["path"]): (vid, entry) for vid, entry in todo}
+            for future in as_completed(futures):
+                vid, entry = futures[future]
+                info = future.result()
+                if info is None:
+                    DISCOVERY["errors"] += 1
+                rows.append(media_info_row(vid, entry, info))
+                DISCOVERY["probed"] += 1
+                if len(rows) >= DB_BATCH_SIZE:
+                    with get_db() as conn:
+                        store_media_info(conn, rows)
+                        conn.commit()
+                    rows = []
+        with get_db() as conn:
+            store_media_info(conn, rows)
+            reclassify_media_info(conn)
+            conn.commit()
+            counts = dict(conn.execute("SELECT action, COUNT(*) FROM media_info GROUP BY action").fetchall())
+        DISCOVERY["status"] = "done"
+        tlog(f"✅ Discovery done: {counts.get('full', 0)} need a full encode, "
+             f"{counts.get('audio', 0)} audio only, {counts.get('remux', 0)} remux, "
+             f"{counts.get('error', 0)} unreadable")
+    except Exception as e:
+        DISCOVERY.update(status="error", error=str(e))
+        tlog(f"❌ Discovery failed: {e}")
+    finally:
+        DISCOVERY["finished"] = datetime.now().isoformat()
+    return True
+
+def refresh_media_info(filepath):
+    """Re-probes the source file behind a transcoded path so the candidate list stays current."""
+    vid = extract_id_from_filename(Path(filepath).name)
+    entry = SOURCE_INDEX.get(vid) if vid else None
+    if not entry:
+        return
+    try:
+        st = os.stat(entry["path"])
+    except OSError:
+        return
+    entry = dict(entry, size=st.st_size, mtime=st.st_mtime)
+    with get_db() as conn:
+        store_media_info(conn, [media_info_row(vid, entry, probe_file(entry["path"]))])
+        conn.commit()
 
 def sanitize(text):
     text = text.encode("ascii", "ignore").decode()
     text = re.sub(r'[\/:*?"<>|]', "_", text)
     return text.strip()
 
-def fetch_all_metadata():
-    log("📥 Fetching all video metadata...")
-    video_map = {}
-    page = 1
-    while True:
-        url = f"{API_URL}/video/?page={page}"
-        try:
-            response = requests.get(url, headers=HEADERS)
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'data' not in data or not data['data']:
-                break
-                
-            for video in data['data']:
-                # Try to find the ID. It might be 'youtube_id' or '_id'
-                vid_id = video.get("youtube_id") or video.get("_id")
-                if not vid_id:
+class TAClientError(Exception):
+    """Raised when the TubeArchivist API can't be reached or keeps failing."""
+
+class TAClient:
+    """
+    Pooled TubeArchivist API client.
+    Requests share one keep-alive Session, time out, and are retried with
+    jittered exponential backoff. After TA_BREAKER_THRESHOLD consecutive
+    failures the circuit breaker opens and calls fail fast until
+    TA_BREAKER_COOLDOWN has passed.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, headers):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(TA_API_CONCURRENCY, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0
+
+    def _check_breaker(self):
+        with self.lock:
+            if self.open_until and time.time() < self.open_until:
+                raise TAClientError(f"Circuit open, TA API unavailable for {int(self.open_until - time.time())}s")
+
+    def _record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.open_until = 0
+            else:
+                self.failures += 1
+                if self.failures >= TA_BREAKER_THRESHOLD:
+                    self.open_until = time.time() + TA_BREAKER_COOLDOWN
+                    log(f"⚡ TA API circuit breaker open for {TA_BREAKER_COOLDOWN}s after {self.failures} failures")
+
+    def get_json(self, path, params=None):
+        """GETs an API path and returns the decoded JSON body."""
+        self._check_breaker()
+        url = f"{self.base_url}{path}"
+        last_error = None
+        for attempt in range(TA_API_RETRIES + 1):
+            if attempt:
+                # Full jitter: sleep somewhere between 0 and the exponential cap
+                time.sleep(random.uniform(0, min(30, 0.5 * 2 ** attempt)))
+            try:
+                response = self.session.get(url, params=params, timeout=TA_API_TIMEOUT)
+                if response.status_code in self.RETRY_STATUS:
+                    last_error = f"HTTP {response.status_code}"
                     continue
-                    
-                title = video.get("title", "unknown_title")
-                channel_info = video.get("channel", {})
-                channel_name = channel_info.get("channel_name") or channel_info.get("channel_title") or "Unknown Channel"
-                # Fix date format: take only first 10 chars (YYYY-MM-DD)
-                raw_date = video.get("published", "unknown_date")
-                published = raw_date[:10] if len(raw_date) >= 10 else raw_date.replace("/", "-")
-                
-                video_map[vid_id] = {
-                    "title": title,
-                    "channel_name": channel_name,
-                    "published": published
-                }
-            
-            # Check pagination to see if we are done
-            if 'paginate' in data:
-                current = data['paginate'].get('current_page')
-                last = data['paginate'].get('last_page')
-                if current is not None and last is not None and current >= last:
+                response.raise_for_status()
+                data = response.json()
+                self._record(True)
+                return data
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = str(e)
+            except (requests.RequestException, ValueError) as e:
+                # Client errors and bad JSON won't fix themselves on retry
+                self._record(False)
+                raise TAClientError(f"{url}: {e}")
+        self._record(False)
+        raise TAClientError(f"{url}: giving up after {TA_API_RETRIES + 1} attempts ({last_error})")
+
+    def video_page(self, page):
+        """Fetches one page of /api/video/, newest downloads first."""
+        return self.get_json("/video/", {"page": page, "sort": "downloaded", "order": "desc"})
+
+ta_client = TAClient(API_URL, HEADERS)
+
+def parse_video(video):
+    """
+    Extracts the fields we care about from a TA /api/video/ entry.
+    Returns (video_id, meta) or (None, None) if the entry has no ID.
+    """
+    # Try to find the ID. It might be 'youtube_id' or '_id'
+    vid_id = video.get("youtube_id") or video.get("_id")
+    if not vid_id:
+        return None, None
+
+    title = video.get("title", "unknown_title")
+    channel_info = video.get("channel", {})
+    channel_name = channel_info.get("channel_name") or channel_info.get("channel_title") or "Unknown Channel"
+    # Fix date format: take only first 10 chars (YYYY-MM-DD)
+    raw_date = video.get("published", "unknown_date")
+    published = raw_date[:10] if len(raw_date) >= 10 else raw_date.replace("/", "-")
+
+    return vid_id, {
+        "title": title,
+        "channel_name": channel_name,
+        "published": published,
+        "media_url": video.get("media_url") or "",
+        "downloaded": str(video.get("date_downloaded") or "")
+    }
+
+def media_path(media_url):
+    """Maps a TA media_url (/media/<channel_id>/<file>) onto SOURCE_DIR."""
+    if not media_url:
+        return None
+    rel = media_url.lstrip("/")
+    if rel.startswith("media/"):
+        rel = rel[len("media/"):]
+    return SOURCE_DIR / rel
+
+def upsert_metadata(conn, rows):
+    """
+    Writes {video_id: meta} into the ta_metadata cache.
+    Unchanged rows are left alone. Returns the number of rows that were new or changed.
+    """
+    before = conn.total_changes
+    for chunk in chunked(rows.items()):
+        conn.executemany("""
+            INSERT INTO ta_metadata
+            (video_id, title, channel_name, published, media_url, downloaded, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(video_id) DO UPDATE SET
+                title = excluded.title, channel_name = excluded.channel_name,
+                published = excluded.published, media_url = excluded.media_url,
+                downloaded = excluded.downloaded, last_seen = CURRENT_TIMESTAMP
+            WHERE title IS NOT excluded.title OR channel_name IS NOT excluded.channel_name
+               OR published IS NOT excluded.published OR media_url IS NOT excluded.media_url
+        """, [(vid_id, meta["title"], meta["channel_name"], meta["published"],
+               meta["media_url"], meta["downloaded"]) for vid_id, meta in chunk])
+    return conn.total_changes - before
+
+def page_rows(data):
+    """Parses the videos on one API page into {video_id: meta}."""
+    rows = {}
+    for video in data.get('data') or []:
+        vid_id, meta = parse_video(video)
+        if vid_id:
+            rows[vid_id] = meta
+    return rows
+
+def sync_metadata(full=False):
+    """
+    Brings the ta_metadata cache up to date with TubeArchivist.
+
+    Incremental syncs walk /api/video/ newest-first and stop at the first page
+    made up entirely of already-known, unchanged videos (the watermark).
+    A full reconcile reads last_page from page 1, fetches the remaining pages
+    concurrently, then drops cached videos TA no longer returns, which catches
+    deletions and edits further down the catalogue.
+    Full reconciles run on first start and every METADATA_FULL_SYNC_HOURS.
+    Returns True if the sync finished, False if any page could not be fetched.
+    """
+    with get_db() as conn:
+        last_full = get_state(conn, "metadata_last_full_sync")
+        if not full:
+            full = last_full is None or time.time() - float(last_full) > METADATA_FULL_SYNC_HOURS * 3600
+
+        mode = "full reconcile" if full else "incremental"
+        log(f"📥 Syncing video metadata ({mode})...")
+        seen = set()
+        changed = 0
+
+        try:
+            first = ta_client.video_page(1)
+        except TAClientError as e:
+            log(f"❌ Error fetching page 1: {e}")
+            return False
+
+        rows = page_rows(first)
+        seen.update(rows)
+        changed += upsert_metadata(conn, rows)
+        conn.commit()
+        last_page = (first.get('paginate') or {}).get('last_page') or 1
+
+        if full:
+            failed = []
+            with ThreadPoolExecutor(max_workers=max(TA_API_CONCURRENCY, 1)) as pool:
+                futures = {pool.submit(ta_client.video_page, page): page for page in range(2, last_page + 1)}
+                for future in as_completed(futures):
+                    page = futures[future]
+                    try:
+                        rows = page_rows(future.result())
+                    except TAClientError as e:
+                        log(f"❌ Error fetching page {page}: {e}")
+                        failed.append(page)
+                        continue
+                    seen.update(rows)
+                    changed += upsert_metadata(conn, rows)
+                    conn.commit()
+                    if len(seen) % 1000 < len(rows):
+                        log(f"   - {len(seen)} videos fetched...")
+            if failed:
+                log(f"⚠️ Metadata sync incomplete: {len(failed)} of {last_page} pages failed. Keeping cached entries.")
+                return False
+        elif rows and changed:
+            page = 2
+            while page <= last_page:
+                try:
+                    rows = page_rows(ta_client.video_page(page))
+                except TAClientError as e:
+                    log(f"❌ Error fetching page {page}: {e}")
+                    conn.commit()
+                    return False
+                page_changed = upsert_metadata(conn, rows)
+                changed += page_changed
+                conn.commit()
+                if not rows or page_changed == 0:
+                    # Everything on this page is already cached: we've reached the watermark.
                     break
+                log(f"   - Page {page} fetched. New/changed so far: {changed}")
+                page += 1
+
+        removed = 0
+        if full:
+            known = {row["video_id"] for row in conn.execute("SELECT video_id FROM ta_metadata")}
+            stale = known - seen
+            for chunk in chunked(stale):
+                conn.executemany("DELETE FROM ta_metadata WHERE video_id = ?", [(vid_id,) for vid_id in chunk])
+            removed = len(stale)
+            set_state(conn, "metadata_last_full_sync", time.time())
+        set_state(conn, "metadata_last_sync", time.time())
+        conn.commit()
+
+    log(f"✅ Metadata sync complete ({mode}). New/changed: {changed}, Removed: {removed}")
+    return True
+
+def load_metadata_map():
+    """Builds the {video_id: meta} map from the ta_metadata cache."""
+    video_map = {}
+    with get_db() as conn:
+        for row in conn.execute("SELECT video_id, title, channel_name, published, media_url FROM ta_metadata"):
+            path = media_path(row["media_url"])
+            video_map[row["video_id"]] = {
+                "title": row["title"],
+                "channel_name": row["channel_name"],
+                "published": row["published"],
+                "filesystem_path": str(path) if path else None
+            }
+    return video_map
+
+def fetch_all_metadata(full=False):
+    """
+    Syncs the metadata cache with TA and returns (video_map, complete).
+    complete is False when the sync failed part-way; the map then holds
+    whatever was cached before, so callers must not prune against it.
+    """
+    complete = sync_metadata(full=full)
+    video_map = load_metadata_map()
+    if complete:
+        log(f"✅ Metadata ready. {len(video_map)} videos cached.")
+    else:
+        log(f"⚠️ Metadata is partial. Using {len(video_map)} cached videos.")
+    return video_map, complete
+
+class MetadataSnapshot:
+    """
+    Process-wide (video_map, complete) snapshot shared by scans, the watcher
+    and the recovery scan. A snapshot is reused for METADATA_TTL seconds or
+    until invalidate(); refreshes are single-flight, so concurrent callers
+    wait for the one in-flight fetch instead of starting their own.
+    Partial snapshots are handed to the callers that waited for them but
+    never reused, and neither is a fetch that was already running when
+    invalidate() was called. Callers must treat the map as read-only.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.value = None
+        self.fetched = 0.0
+        self.inflight = None
+        self.error = None
+        self.generation = 0 # Bumped by invalidate()
+
+    def get(self, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            if self.value and self.value[1] and time.time() - self.fetched < max_age:
+                return self.value
+            flight = self.inflight
+            generation = self.generation
+            if flight is None:
+                flight = self.inflight = threading.Event()
+                owner = True
             else:
-                pass
+                owner = False
 
-            log(f"   - Page {page} fetched. Total videos so far: {len(video_map)}")
-            page += 1
-            
+        if not owner:
+            flight.wait()
+            with self.lock:
+                if self.error is not None:
+                    raise self.error
+                return self.value
+
+        try:
+            value = fetch_all_metadata()
+            error = None
         except Exception as e:
-            log(f"❌ Error fetching page {page}: {e}")
-            break
-            
-    log(f"✅ Metadata fetch complete. Found {len(video_map)} videos.")
-    return video_map
+            value, error = None, e
+        with self.lock:
+            self.error = error
+            if value is not None:
+                self.value = value
+                fresh = value[1] and generation == self.generation
+                self.fetched = time.time() if fresh else 0.0
+            self.inflight = None
+        flight.set()
+        if error is not None:
+            raise error
+        return value
+
+    def invalidate(self):
+        """Forces the next get() to re-sync with TA."""
+        with self.lock:
+            self.fetched = 0.0
+            self.generation += 1
+
+metadata_snapshot = MetadataSnapshot(METADATA_TTL)
 
 def cleanup_old_folders():
     """
@@ -391,77 +1719,209 @@ def cleanup_old_folders():
                     
     log(f"🧹 Cleanup complete. Removed: {cleaned_count}, Skipped: {skipped_count}")
 
-def check_orphaned_links():
+ORPHAN_CHECK = {
+    "status": "idle", # idle, running, done, error
+    "phase": None, # listing, checking, saving
+    "total": 0,
+    "checked": 0,
+    "skipped": 0,
+    "broken": 0,
+    "repaired": 0,
+    "started": None,
+    "finished": None,
+    "error": None
+}
+ORPHAN_RESULTS = [] # Broken links found by the current/last check, in discovery order
+orphan_lock = threading.Lock()
+
+def local_target(target):
+    """Maps a link target written for the media server (HOST_SOURCE_DIR) to the path inside this container."""
+    try:
+        return SOURCE_DIR / Path(target).relative_to(HOST_SOURCE_DIR)
+    except ValueError:
+        return Path(target)
+
+def list_channel_links(channel_path):
+    """Returns [(link_path, folder, target)] for the video.* links in one target channel folder."""
+    links = []
+    try:
+        with os.scandir(channel_path) as it:
+            video_dirs = [(entry.path, entry.name) for entry in it if entry.is_dir(follow_symlinks=False)]
+        for video_dir, folder in video_dirs:
+            with os.scandir(video_dir) as it:
+                for entry in it:
+                    if entry.name.startswith("video.") and entry.is_symlink():
+                        links.append((entry.path, folder, os.readlink(entry.path)))
+    except OSError as e:
+        log(f"   ❌ ERROR: {channel_path}: {e}")
+    return links
+
+def repair_orphaned_links(orphaned):
+    """
+    Relinks broken links whose video still exists somewhere under SOURCE_DIR
+    (renamed, or moved to another channel folder). One source index build
+    covers every link, then each repair is a dictionary lookup. Repaired
+    entries get "repaired" set to the new link path; returns how many were fixed.
+    """
+    if not orphaned:
+        return 0
+    repaired = 0
+    with tree_lock:
+        index = build_source_index()
+        for orphan in orphaned:
+            name = Path(orphan["target"]).name
+            vid = extract_id_from_filename(name) or Path(name).stem
+            entry = index.get(vid)
+            if not entry:
+                continue
+            link = Path(orphan["path"])
+            new_link = link.with_name(f"video{entry['suffix']}")
+            new_target = str(HOST_SOURCE_DIR / entry["path"].relative_to(SOURCE_DIR))
+            try:
+                # Swap the link in place so it never disappears
+                tmp = link.with_name(f".{new_link.name}.repair")
+                if tmp.is_symlink():
+                    tmp.unlink()
+                os.symlink(new_target, tmp)
+                os.replace(tmp, new_link)
+                if new_link != link:
+                    link.unlink()
+            except OSError as e:
+                log(f"   ❌ Repair failed for {orphan['folder']}: {e}")
+                continue
+            orphan.update(video_id=vid, repaired=str(new_link), target=new_target)
+            repaired += 1
+            log(f"   [FIX] Repaired: {orphan['folder']} -> {new_target}")
+    return repaired
+
+def check_orphaned_links(repair=None):
     """
-    Scans TARGET_DIR for video.mp4 symlinks and checks if they point to valid files.
-    For orphaned links, parses the folder structure to extract metadata.
-    Stores results in database.
+    Scans TARGET_DIR for video.* symlinks and checks if they point to valid files.
+    Listing and the (latency-bound) existence checks run on a thread pool;
+    links whose target is unchanged and was verified within
+    ORPHAN_RECHECK_HOURS are skipped. Progress and broken links are published
+    in ORPHAN_CHECK / ORPHAN_RESULTS as they are found.
+    For orphaned links, parses the folder structure to extract metadata and,
+    with repair (default ORPHAN_AUTO_REPAIR), relinks those whose video is
+    still in the source library. Stores results in database.
     """
+    if repair is None:
+        repair = ORPHAN_AUTO_REPAIR
     log("🔍 Checking for orphaned symlinks...")
-    orphaned = []
-    total_checked = 0
-    
-    if not TARGET_DIR.exists():
-        log("⚠️ Target directory does not exist")
-        return orphaned
+    orphaned = ORPHAN_RESULTS
+    del orphaned[:]
+    ORPHAN_CHECK.update(status="running", phase="listing", total=0, checked=0, skipped=0, broken=0, repaired=0,
+                        started=datetime.now().isoformat(), finished=None, error=None)
 
-    with get_db() as conn:
-        for channel_dir in TARGET_DIR.iterdir():
-            if not channel_dir.is_dir():
-                continue
-                
-            channel_name = channel_dir.name
-                
-            for video_dir in channel_dir.iterdir():
-                if not video_dir.is_dir():
+    try:
+        if not TARGET_DIR.exists():
+            log("⚠️ Target directory does not exist")
+            ORPHAN_CHECK["status"] = "done"
+            return orphaned
+
+        with os.scandir(TARGET_DIR) as it:
+            channel_paths = [(entry.path, entry.name) for entry in it if entry.is_dir(follow_symlinks=False)]
+        with get_db() as conn:
+            recorded_checks = {row["path"]: (row["target"], row["checked"], row["ok"]) for row in
+                               conn.execute("SELECT path, target, checked, ok FROM link_checks")}
+
+        cutoff = time.time() - ORPHAN_RECHECK_HOURS * 3600
+        checks = []
+        seen = set()
+        with ThreadPoolExecutor(max_workers=ORPHAN_CHECK_WORKERS) as pool:
+            for (channel_path, channel_name), links in zip(channel_paths, pool.map(list_channel_links, [c[0] for c in channel_paths])):
+                for path, folder, target in links:
+                    ORPHAN_CHECK["total"] += 1
+                    seen.add(path)
+                    recorded = recorded_checks.get(path)
+                    if recorded and recorded[2] and recorded[0] == target and recorded[1] >= cutoff:
+                        ORPHAN_CHECK["skipped"] += 1
+                    else:
+                        checks.append((path, folder, channel_name, target))
+
+            ORPHAN_CHECK["phase"] = "checking"
+            futures = {pool.submit(os.path.exists, local_target(c[3])): c for c in checks}
+            results = []
+            for future in as_completed(futures):
+                path, folder, channel_name, target = futures[future]
+                ok = future.result()
+                results.append((path, target, int(ok), time.time()))
+                ORPHAN_CHECK["checked"] += 1
+                if ok:
                     continue
-                    
-                folder_name = video_dir.name
-                
-                # Look for video files
-                for video_file in video_dir.glob("video.*"):
-                    total_checked += 1
-                    
-                    if video_file.is_symlink():
-                        try:
-                            # Check if the symlink target exists
-                            target = Path(os.readlink(video_file))
-                            
-                            if not target.exists():
-                                # Parse folder name: "YYYY-MM-DD - Title"
-                                parts = folder_name.split(" - ", 1)
-                                published = parts[0] if len(parts) > 0 else "unknown"
-                                title = parts[1] if len(parts) > 1 else folder_name
-                                
-                                # Try to extract video ID from symlink target path
-                                video_id = target.stem if target.stem else "unknown"
-                                
-                                orphaned.append({
-                                    "video_id": video_id,
-                                    "path": str(video_file),
-                                    "target": str(target),
-                                    "folder": folder_name,
-                                    "channel": channel_name,
-                                    "title": title,
-                                    "published": published
-                                })
-                                
-                                # Store in DB
-                                conn.execute("""
-                                    INSERT OR REPLACE INTO videos 
-                                    (video_id, title, channel, published, symlink, status)
-                                    VALUES (?, ?, ?, ?, ?, 'missing')
-                                """, (video_id, title, channel_name, published, str(video_file)))
-                                
-                                log(f"   ⚠️ BROKEN: {folder_name} -> {target}")
-                        except Exception as e:
-                            log(f"   ❌ ERROR: {folder_name}: {e}")
-                            
-        conn.commit()
-                        
-    log(f"✅ Check complete. Scanned {total_checked} files, found {len(orphaned)} orphaned symlinks.")
+                # Parse folder name: "YYYY-MM-DD - Title"
+                parts = folder.split(" - ", 1)
+                orphaned.append({
+                    "video_id": Path(target).stem or "unknown",
+                    "path": path,
+                    "target": target,
+                    "folder": folder,
+                    "channel": channel_name,
+                    "title": parts[1] if len(parts) > 1 else folder,
+                    "published": parts[0] if parts else "unknown"
+                })
+                ORPHAN_CHECK["broken"] += 1
+                log(f"   ⚠️ BROKEN: {folder} -> {target}")
+
+        if repair and orphaned:
+            ORPHAN_CHECK["phase"] = "repairing"
+            ORPHAN_CHECK["repaired"] = repair_orphaned_links(orphaned)
+
+        ORPHAN_CHECK["phase"] = "saving"
+        fixed = [o for o in orphaned if o.get("repaired")]
+        missing = [o for o in orphaned if not o.get("repaired")]
+        now = time.time()
+        with get_db() as conn:
+            for chunk in chunked(results, DB_BATCH_SIZE):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO link_checks (path, target, ok, checked) VALUES (?, ?, ?, ?)", chunk
+                )
+            conn.executemany("DELETE FROM link_checks WHERE path = ?",
+                             [(path,) for path in recorded_checks if path not in seen])
+            for chunk in chunked(missing, DB_BATCH_SIZE):
+                conn.executemany("""
+                    INSERT OR REPLACE INTO videos 
+                    (video_id, title, channel, published, symlink, status)
+                    VALUES (?, ?, ?, ?, ?, 'missing')
+                """, [(o["video_id"], o["title"], o["channel"], o["published"], o["path"]) for o in chunk])
+            for chunk in chunked(fixed, DB_BATCH_SIZE):
+                conn.executemany("DELETE FROM videos WHERE symlink = ? AND status = 'missing'",
+                                 [(o["path"],) for o in chunk])
+                conn.executemany("""
+                    INSERT INTO videos (video_id, title, channel, published, symlink, status, last_updated)
+                    VALUES (?, ?, ?, ?, ?, 'linked', CURRENT_TIMESTAMP)
+                    ON CONFLICT(video_id) DO UPDATE SET
+                        symlink = excluded.symlink, status = 'linked', last_updated = CURRENT_TIMESTAMP
+                """, [(o["video_id"], o["title"], o["channel"], o["published"], o["repaired"]) for o in chunk])
+                conn.executemany("DELETE FROM link_checks WHERE path = ?", [(o["path"],) for o in chunk])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO link_checks (path, target, ok, checked) VALUES (?, ?, 1, ?)",
+                    [(o["repaired"], o["target"], now) for o in chunk]
+                )
+            conn.commit()
+        if orphaned:
+            bump_library_version()
+        ORPHAN_CHECK["status"] = "done"
+    except Exception as e:
+        ORPHAN_CHECK.update(status="error", error=str(e))
+        log(f"❌ Orphan check failed: {e}")
+    finally:
+        ORPHAN_CHECK["phase"] = None
+        ORPHAN_CHECK["finished"] = datetime.now().isoformat()
+
+    log(f"✅ Check complete. Scanned {ORPHAN_CHECK['total']} links ({ORPHAN_CHECK['skipped']} recently verified), "
+        f"found {len(orphaned)} orphaned symlinks, repaired {ORPHAN_CHECK['repaired']}.")
     return orphaned
 
+def start_orphan_check(repair=None):
+    """Runs check_orphaned_links() in the background; returns False if one is already running."""
+    with orphan_lock:
+        if ORPHAN_CHECK["status"] == "running":
+            return False
+        ORPHAN_CHECK["status"] = "running"
+    threading.Thread(target=check_orphaned_links, args=(repair,), daemon=True).start()
+    return True
+
 def extract_id_from_filename(filename):
     """
     Extracts YouTube ID from filename.
@@ -478,18 +1938,99 @@ def extract_id_from_filename(filename):
         
     return None
 
-def scan_for_unindexed_videos():
+# Latest source index, shared by scans and the transcode path
+SOURCE_INDEX = {}
+
+def scan_source_channel(channel_path):
+    """
+    Lists one source channel folder with a single os.scandir pass.
+    Returns {video_id: entry}; each entry keeps the stat data from the DirEntry.
+    """
+    found = {}
+    try:
+        with os.scandir(channel_path) as it:
+            for entry in it:
+                suffix = os.path.splitext(entry.name)[1].lower()
+                if suffix not in VIDEO_EXTENSIONS or not entry.is_file():
+                    continue
+                vid_id = extract_id_from_filename(entry.name)
+                if not vid_id or vid_id in found:
+                    continue
+                st = entry.stat()
+                found[vid_id] = {
+                    "path": Path(entry.path),
+                    "name": entry.name,
+                    "suffix": suffix,
+                    "channel": os.path.basename(channel_path),
+                    "size": st.st_size,
+                    "mtime": st.st_mtime
+                }
+    except OSError as e:
+        log(f"   ⚠️ Could not list {channel_path}: {e}")
+    return found
+
+def build_source_index(on_channel=None):
+    """
+    Builds the {video_id: entry} map for everything under SOURCE_DIR,
+    one directory listing per channel (listed in parallel), and publishes
+    it as SOURCE_INDEX. on_channel(channel_path, found) is called as each
+    channel finishes.
+    """
+    global SOURCE_INDEX
+    index = {}
+    channel_paths = []
+    if SOURCE_DIR.exists():
+        with os.scandir(SOURCE_DIR) as it:
+            channel_paths = [entry.path for entry in it if entry.is_dir()]
+        listings = {}
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+            futures = {pool.submit(scan_source_channel, path): path for path in channel_paths}
+            for future in as_completed(futures):
+                listings[futures[future]] = future.result()
+                if on_channel:
+                    on_channel(futures[future], listings[futures[future]])
+        # Merge in listing order so duplicate IDs resolve the same way every time
+        for channel_path in channel_paths:
+            for vid_id, entry in listings[channel_path].items():
+                index.setdefault(vid_id, entry)
+    SOURCE_INDEX = index
+    log(f"🗂️ Source index built: {len(index)} files in {len(channel_paths)} channels.")
+    return index
+
+def scan_target_channel(channel_path):
+    """Lists the real (non-symlink) video files directly inside one target channel folder."""
+    found = []
+    try:
+        with os.scandir(channel_path) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in VIDEO_EXTENSIONS:
+                    continue
+                # We only care about REAL files, not symlinks
+                if entry.is_symlink() or not entry.is_file():
+                    continue
+                found.append((entry.path, entry.name, entry.stat().st_size))
+    except OSError as e:
+        log(f"   ⚠️ Could not list {channel_path}: {e}")
+    return found
+
+def scan_for_unindexed_videos(on_results=None):
     """
     Scans both SOURCE_DIR and TARGET_DIR for files.
     Classifies them as:
     - unindexed: Not in TA DB (Needs Import)
     - redundant: In TA DB AND Source exists (Safe Duplicate)
     - rescue: In TA DB BUT Source missing (Needs Rescue/Import)
+    - lost: Not in TA DB and marked as lost media
+    Channels are listed in parallel with os.scandir (stats come from the
+    directory entries); on_results(category, items) is called per channel
+    as results come in.
     """
     log("🔍 Scanning for unindexed and legacy files...")
     
     # 1. Fetch current known IDs and their source paths
-    video_map = fetch_all_metadata() # {id: {path: ..., ...}}
+    video_map, complete = metadata_snapshot.get() # {id: {filesystem_path: ..., ...}}
+    if not complete:
+        raise RuntimeError("TA metadata is incomplete, refusing to classify files as unindexed")
     known_ids = set(video_map.keys())
     
     # Fetch Lost Media IDs
@@ -504,80 +2045,74 @@ def scan_for_unindexed_videos():
         "lost": []
     }
 
-    # Helper to check if file is video
-    def is_video(f):
-        return f.suffix.lower() in ['.mp4', '.mkv', '.webm', '.mov']
+    def publish(batch):
+        for category, items in batch.items():
+            if items:
+                results[category].extend(items)
+                if on_results:
+                    on_results(category, items)
 
     # --- Scan SOURCE_DIR (Standard Orphan Check) ---
-    if SOURCE_DIR.exists():
-        for channel_path in SOURCE_DIR.iterdir():
-            if not channel_path.is_dir(): continue
-            for video_file in channel_path.glob("*.*"):
-                if not is_video(video_file): continue
-                
-                vid_id = extract_id_from_filename(video_file.name)
-                if vid_id and vid_id not in known_ids:
-                    # Check if it is known LOST media
-                    file_info = {
-                        "path": str(video_file),
-                        "filename": video_file.name,
-                        "video_id": vid_id,
-                        "size_mb": round(video_file.stat().st_size / (1024*1024), 2),
-                        "ta_source": "Source Dir"
-                    }
-                    
-                    if vid_id in lost_ids:
-                         results["lost"].append(file_info)
-                    else:
-                        results["unindexed"].append(file_info)
-
+    def source_channel_done(channel_path, found):
+        batch = {"unindexed": [], "lost": []}
+        for vid_id, entry in found.items():
+            if vid_id in known_ids:
+                continue
+            file_info = {
+                "path": str(entry["path"]),
+                "filename": entry["name"],
+                "video_id": vid_id,
+                "size_mb": round(entry["size"] / (1024*1024), 2),
+                "ta_source": "Source Dir"
+            }
+            # Check if it is known LOST media
+            batch["lost" if vid_id in lost_ids else "unindexed"].append(file_info)
+        publish(batch)
+
+    index = build_source_index(on_channel=source_channel_done)
 
     # --- Scan TARGET_DIR (Legacy "Pinchflat" Check) ---
     if TARGET_DIR.exists():
-        for channel_path in TARGET_DIR.iterdir():
-            if not channel_path.is_dir(): continue
-            for video_file in channel_path.glob("*.*"):
-                if not is_video(video_file): continue
-                
-                # We only care about REAL files, not symlinks
-                if video_file.is_symlink():
-                    continue
-                    
-                vid_id = extract_id_from_filename(video_file.name)
-                
-                # Case 1: ID NOT in TA -> Recoverable
-                if vid_id and vid_id not in known_ids:
-                     results["unindexed"].append({
-                        "path": str(video_file),
-                        "filename": video_file.name,
-                        "video_id": vid_id,
-                        "type": "target_realfile",
-                        "size_mb": round(video_file.stat().st_size / (1024 * 1024), 2)
-                    })
-                
-                # Case 2: ID IS in TA
-                elif vid_id:
-                    # Check if TA's source file actually exists
-                    ta_source_path = Path(video_map[vid_id]['filesystem_path'])
-                    
-                    if ta_source_path.exists():
-                        # TA has it, Source exists. This file is REDUNDANT.
-                        results["redundant"].append({
-                            "path": str(video_file),
-                            "filename": video_file.name,
+        with os.scandir(TARGET_DIR) as it:
+            channel_paths = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+            futures = [pool.submit(scan_target_channel, path) for path in channel_paths]
+            for future in as_completed(futures):
+                batch = {"unindexed": [], "redundant": [], "rescue": []}
+                for path, name, size in future.result():
+                    vid_id = extract_id_from_filename(name)
+                    if not vid_id:
+                        continue
+                    size_mb = round(size / (1024 * 1024), 2)
+
+                    # Case 1: ID NOT in TA -> Recoverable
+                    if vid_id not in known_ids:
+                        batch["unindexed"].append({
+                            "path": path,
+                            "filename": name,
                             "video_id": vid_id,
-                            "ta_source": str(ta_source_path),
-                            "size_mb": round(video_file.stat().st_size / (1024 * 1024), 2)
+                            "type": "target_realfile",
+                            "size_mb": size_mb
                         })
+                        continue
+
+                    # Case 2: ID IS in TA
+                    # Check if TA's source file actually exists (the index already saw it)
+                    ta_source_path = video_map[vid_id]['filesystem_path']
+                    if vid_id in index or (ta_source_path and Path(ta_source_path).exists()):
+                        # TA has it, Source exists. This file is REDUNDANT.
+                        category = "redundant"
                     else:
                         # TA has it, BUT source is MISSING. This file is a RESCUE candidate.
-                        results["rescue"].append({
-                            "path": str(video_file),
-                            "filename": video_file.name,
-                            "video_id": vid_id,
-                            "ta_source": str(ta_source_path), # Missing path
-                            "size_mb": round(video_file.stat().st_size / (1024 * 1024), 2)
-                        })
+                        category = "rescue"
+                    batch[category].append({
+                        "path": path,
+                        "filename": name,
+                        "video_id": vid_id,
+                        "ta_source": str(ta_source_path),
+                        "size_mb": size_mb
+                    })
+                publish(batch)
 
     log(f"✅ Scan complete. Unindexed: {len(results['unindexed'])}, Redundant: {len(results['redundant'])}, Rescue: {len(results['rescue'])}")
     return results
@@ -585,10 +2120,10 @@ def scan_for_unindexed_videos():
 def recover_video_metadata(filepath):
     """
     Uses yt-dlp to fetch metadata for a video file and prepares it for import.
+    The video itself is staged in the background (see finish_import), so a
+    multi-GB copy doesn't hold up the caller.
     """
     import subprocess
-    import shutil
-    import json
     
     src_path = Path(filepath)
     if not src_path.exists():
@@ -607,6 +2142,10 @@ def recover_video_metadata(filepath):
     
     log(f"🚑 Recovering: {vid_id} ...")
     
+    cached = unavailable_reason(vid_id)
+    if cached:
+        return False, f"Skipped, unavailable on YouTube: {cached}"
+    
     # 1. Fetch Metadata using yt-dlp
     cmd = [
         "yt-dlp",
@@ -628,265 +2167,1067 @@ def recover_video_metadata(filepath):
             error_msg = result.stderr.strip() or "Unknown Error"
             log(f"   ⚠️ yt-dlp failed (Exit Code {result.returncode}). Error: {error_msg}")
             
-            # Smart Detection: Only mark as LOST if it's actually a "Video unavailable" error
-            # If it's a network error, maybe we shouldn't mark it as lost yet?
-            # For now, let's just log it better and still allow the user to see it in Lost Media (where they can 'Force' or 'Delete')
+            # Smart Detection: Only mark as LOST if it's actually a "Video unavailable" error.
+            # Network errors and the like are left for a retry.
+            if not is_unavailable(error_msg):
+                return False, f"yt-dlp failed: {error_msg}"
+            mark_unavailable(vid_id, src_path, error_msg)
+            return False, f"yt-dlp failed: {error_msg} (Added to Lost Media)"
+
             
+        # 2. Copy/Symlink Video File
+        threading.Thread(target=finish_import, args=(src_path, dest_video, vid_id, filepath), daemon=True).start()
+            
+        return True, "Metadata fetched, staging video for import"
+        
+    except Exception as e:
+        log(f"   ❌ Recovery failed: {e}")
+        return False, str(e)
+
+UNAVAILABLE_MARKERS = ("Video unavailable", "Private video", "This video has been removed",
+                       "account associated with this video has been terminated")
+
+def is_unavailable(error):
+    """True for yt-dlp errors that mean the video is gone, not that the request failed."""
+    return any(marker in error for marker in UNAVAILABLE_MARKERS)
+
+def unavailable_reason(video_id):
+    """The cached 'unavailable' reason for a video, or None if it's unknown or expired."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT reason FROM unavailable_videos WHERE video_id = ? AND checked > datetime('now', ?)",
+            (video_id, f"-{RECOVERY_UNAVAILABLE_DAYS} days")
+        ).fetchone()
+    return row["reason"] if row else None
+
+def mark_unavailable(video_id, filepath, reason):
+    """Adds a video to the negative cache and to Lost Media."""
+    with get_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO unavailable_videos (video_id, reason) VALUES (?, ?)", (video_id, reason[:500]))
+        conn.execute("INSERT OR REPLACE INTO lost_media (video_id, filepath) VALUES (?, ?)", (video_id, str(filepath)))
+        conn.commit()
+
+# File copies
+# Videos are several GB, so a copy tries the cheapest route first: a hardlink,
+# a reflink (btrfs/XFS/ZFS share the blocks), then a kernel-side copy that
+# never passes the data through Python, and only then a buffered copy.
+
+COPY_CHUNK = 8 * 1024 * 1024
+FICLONE = 0x40049409  # linux/fs.h
+copy_slots = threading.BoundedSemaphore(max(1, COPY_CONCURRENCY))
+COPIES = {}  # dest -> progress of running copies, and of recently finished ones
+COPY_RESULT_TTL = 300  # Seconds a finished copy stays listed
+COPY_RESULTS_MAX = 200  # Finished copies kept at most
+copies_lock = threading.Lock()
+
+def prune_copies():
+    """Forgets finished copies past COPY_RESULT_TTL, and the oldest beyond COPY_RESULTS_MAX. Call with copies_lock held."""
+    cutoff = time.time() - COPY_RESULT_TTL
+    finished = sorted((c["finished"], dest) for dest, c in COPIES.items() if c.get("finished"))
+    for i, (when, dest) in enumerate(finished):
+        if when < cutoff or i < len(finished) - COPY_RESULTS_MAX:
+            del COPIES[dest]
+
+def try_reflink(src_fd, dst_fd):
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+def copy_data(src_fd, dst_fd, size, progress):
+    """Copies size bytes with copy_file_range, sendfile or read/write, whichever works first."""
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(("copy_file_range", lambda n: os.copy_file_range(src_fd, dst_fd, n)))
+    if hasattr(os, "sendfile"):
+        methods.append(("sendfile", lambda n: os.sendfile(dst_fd, src_fd, None, n)))
+    methods.append(("buffered", lambda n: os.write(dst_fd, os.read(src_fd, n))))
+
+    start = time.time()
+    copied = 0
+    while copied < size:
+        try:
+            n = methods[0][1](min(COPY_CHUNK, size - copied))
+        except OSError as e:
+            # Unsupported here (old kernel, FUSE, SMB...): fall back before any data moved
+            if copied or len(methods) == 1 or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF):
+                raise
+            methods.pop(0)
+            continue
+        if n == 0:
+            # Some filesystems answer copy_file_range with 0 bytes instead of an error
+            if copied or len(methods) == 1:
+                break
+            methods.pop(0)
+            continue
+        copied += n
+        elapsed = time.time() - start
+        if COPY_MAX_MBPS > 0:
+            # Sleep until we're back under the cap
+            ahead = copied / (COPY_MAX_MBPS * 2**20) - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+                elapsed += ahead
+        progress.update(method=methods[0][0], bytes=copied, rate_mbps=round(copied / 2**20 / max(elapsed, 0.001), 1))
+    return methods[0][0]
+
+def copy_file(src, dest, link=True, part=None):
+    """
+    Puts a copy of src at dest and returns how: "hardlink", "reflink",
+    "copy_file_range", "sendfile" or "buffered". Data is written to a
+    partial file, checked against the source size and renamed into place,
+    so dest never holds a truncated file.
+    """
+    src, dest = str(src), str(dest)
+    progress = {"src": src, "dest": dest, "status": "waiting", "method": None, "bytes": 0, "total": 0,
+                "rate_mbps": 0, "finished": None}
+    with copies_lock:
+        prune_copies()
+        COPIES[dest] = progress
+    try:
+        size = os.path.getsize(src)
+        progress["total"] = size
+        if link:
+            try:
+                if os.path.lexists(dest):
+                    os.unlink(dest)
+                os.link(src, dest)
+                progress.update(status="done", method="hardlink", bytes=size, finished=time.time())
+                return "hardlink"
+            except OSError:
+                pass
+        part = part or os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.part")
+        with copy_slots:
+            progress["status"] = "copying"
+            start = time.time()
+            try:
+                with open(src, 'rb') as fsrc, open(part, 'wb') as fdst:
+                    if try_reflink(fsrc.fileno(), fdst.fileno()):
+                        method = "reflink"
+                        progress.update(method=method, bytes=size)
+                    else:
+                        method = copy_data(fsrc.fileno(), fdst.fileno(), size, progress)
+                    written = os.fstat(fdst.fileno()).st_size
+                if written != size:
+                    raise OSError(f"Short copy of {src}: {written} of {size} bytes")
+                shutil.copystat(src, part)
+                os.replace(part, dest)
+            except BaseException:
+                if os.path.exists(part):
+                    os.unlink(part)
+                raise
+        elapsed = time.time() - start
+        progress.update(status="done", rate_mbps=round(size / 2**20 / max(elapsed, 0.001), 1), finished=time.time())
+        log(f"   📂 Copied {size // 2**20} MB via {method} ({progress['rate_mbps']} MB/s)")
+        return method
+    except Exception as e:
+        progress.update(status="failed", error=str(e), finished=time.time())
+        raise
+
+def stage_import_video(src_path, dest_video):
+    """Puts a video next to its metadata in IMPORT_DIR, hardlinking when possible."""
+    # TA import consumes files, so no symlinks: hardlink, or copy across filesystems
+    if copy_file(src_path, dest_video) == "hardlink":
+        log("   🔗 Hardlinked video file.")
+
+# Bulk recovery jobs
+# Files are queued in SQLite and fetched by a small worker pool, one yt-dlp
+# run per batch of videos, so hundreds of files cost a handful of processes.
+
+recovery_queue_changed = threading.Condition()
+
+def enqueue_recovery(filepaths, force=False):
+    """
+    Queues files for metadata recovery. Files whose video is in the
+    unavailable cache are recorded as 'unavailable' right away unless force.
+    Returns {"queued": n, "unavailable": n, "invalid": n, "jobs": {path: id}}.
+    """
+    summary = {"queued": 0, "unavailable": 0, "invalid": 0, "jobs": {}}
+    with get_db() as conn:
+        for filepath in filepaths:
+            vid_id = extract_id_from_filename(Path(filepath).name)
+            status, message = "queued", None
+            if not vid_id:
+                status, message = "failed", "Could not extract Video ID from filename"
+                summary["invalid"] += 1
+            elif not force:
+                cached = unavailable_reason(vid_id)
+                if cached:
+                    status, message = "unavailable", f"Cached: {cached}"
+                    summary["unavailable"] += 1
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO recovery_jobs (filepath, video_id, status, message, finished) "
+                "VALUES (?, ?, ?, ?, CASE WHEN ? = 'queued' THEN NULL ELSE CURRENT_TIMESTAMP END)",
+                (str(filepath), vid_id, status, message, status)
+            )
+            if cur.rowcount:
+                summary["jobs"][str(filepath)] = cur.lastrowid
+                summary["queued"] += status == "queued"
+            else:
+                row = conn.execute(
+                    "SELECT id FROM recovery_jobs WHERE filepath = ? AND status IN ('queued', 'running')",
+                    (str(filepath),)
+                ).fetchone()
+                summary["jobs"][str(filepath)] = row["id"]
+        conn.commit()
+    if summary["queued"]:
+        with recovery_queue_changed:
+            recovery_queue_changed.notify_all()
+    return summary
+
+def claim_recovery_batch():
+    """Marks up to RECOVERY_BATCH_SIZE queued jobs as running and returns them. Call with recovery_queue_changed held."""
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM recovery_jobs WHERE status = 'queued' ORDER BY id LIMIT ?", (RECOVERY_BATCH_SIZE,)
+        ).fetchall()
+        conn.executemany("UPDATE recovery_jobs SET status = 'running' WHERE id = ?", [(row["id"],) for row in rows])
+        conn.commit()
+        return [dict(row) for row in rows]
+
+def finish_recovery_job(conn, job_id, status, message):
+    conn.execute(
+        "UPDATE recovery_jobs SET status = ?, message = ?, finished = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, message, job_id)
+    )
+
+def run_recovery_batch(jobs):
+    """
+    Fetches metadata for a batch of videos with one yt-dlp run (--batch-file),
+    then stages each recovered video for import. Per-video errors are read
+    from yt-dlp's output; "unavailable" ones go to the negative cache.
+    """
+    import subprocess
+    import tempfile
+    IMPORT_DIR.mkdir(parents=True, exist_ok=True)
+    workdir = Path(tempfile.mkdtemp(prefix=".recovery-", dir=IMPORT_DIR))
+    try:
+        batch_file = workdir / "batch.txt"
+        # The same video can be queued from more than one path: fetch it once
+        video_ids = dict.fromkeys(job["video_id"] for job in jobs)
+        batch_file.write_text("".join(f"https://www.youtube.com/watch?v={video_id}\n" for video_id in video_ids))
+        cmd = [
+            "yt-dlp",
+            "--write-info-json",
+            "--skip-download",
+            "--ignore-errors",
+            "--no-warnings",
+            "--sleep-requests", str(RECOVERY_SLEEP_REQUESTS),
+            "--batch-file", str(batch_file),
+            "-o", f"{workdir}/%(id)s.%(ext)s"
+        ]
+        log(f"🚑 Recovering batch of {len(jobs)} videos...")
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60 + 60 * len(jobs))
+            output = result.stderr + result.stdout
+        except Exception as e:
+            output = f"ERROR: yt-dlp did not run: {e}"
+
+        errors = {}
+        for match in re.finditer(r"ERROR: (?:\[[^\]]+\] )?([A-Za-z0-9_-]{11}): (.+)", output):
+            errors[match.group(1)] = match.group(2).strip()
+
+        recovered = 0
+        with get_db() as conn:
+            for job in jobs:
+                src_path = Path(job["filepath"])
+                info = workdir / f"{job['video_id']}.info.json"
+                if info.exists() and info.stat().st_size > 0:
+                    try:
+                        if not src_path.exists():
+                            raise FileNotFoundError("File not found")
+                        # Copied, not moved: other jobs in the batch may share this video ID
+                        shutil.copyfile(info, IMPORT_DIR / f"{src_path.stem}.info.json")
+                        stage_import_video(src_path, IMPORT_DIR / src_path.name)
+                        finish_recovery_job(conn, job["id"], "done", "Ready for import")
+                        forget_recovery_result(src_path)
+                        recovered += 1
+                    except Exception as e:
+                        finish_recovery_job(conn, job["id"], "failed", f"Failed to move video: {e}")
+                    continue
+                # Only this video's own error line can say it's gone; anything else is a retryable failure
+                error = errors.get(job["video_id"])
+                if error is None:
+                    finish_recovery_job(conn, job["id"], "failed", "yt-dlp wrote no metadata for this video")
+                elif is_unavailable(error):
+                    mark_unavailable(job["video_id"], src_path, error)
+                    finish_recovery_job(conn, job["id"], "unavailable", f"{error} (Added to Lost Media)")
+                else:
+                    finish_recovery_job(conn, job["id"], "failed", f"yt-dlp failed: {error}")
+            conn.commit()
+        if recovered:
+            metadata_snapshot.invalidate()
+        log(f"🚑 Batch done: {recovered}/{len(jobs)} ready for import")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def recovery_worker():
+    while True:
+        with recovery_queue_changed:
+            jobs = claim_recovery_batch()
+            if not jobs:
+                recovery_queue_changed.wait(timeout=60)
+                continue
+        try:
+            run_recovery_batch(jobs)
+        except Exception as e:
+            log(f"❌ Recovery batch failed: {e}")
             with get_db() as conn:
-                conn.execute("INSERT OR REPLACE INTO lost_media (video_id, filepath) VALUES (?, ?)", (vid_id, str(src_path)))
+                for job in jobs:
+                    conn.execute(
+                        "UPDATE recovery_jobs SET status = 'failed', message = ?, finished = CURRENT_TIMESTAMP "
+                        "WHERE id = ? AND status = 'running'", (str(e), job["id"])
+                    )
                 conn.commit()
-            return False, f"yt-dlp failed: {error_msg} (Added to Lost Media)"
 
-            
-        # 2. Copy/Symlink Video File
-        try:
-            # We hardlink if possible to save space/time, otherwise copy
-            if dest_video.exists():
-                dest_video.unlink()
-            
-            # Try symlink first? No, TA import consumes files. Copying is safer or hardlink.
-            # Let's try hardlink (link)
+def start_recovery_workers():
+    """Requeues recovery jobs interrupted by a restart and starts the worker pool."""
+    with get_db() as conn:
+        conn.execute("UPDATE recovery_jobs SET status = 'queued' WHERE status = 'running'")
+        conn.commit()
+    for _ in range(max(1, RECOVERY_WORKERS)):
+        threading.Thread(target=recovery_worker, daemon=True).start()
+
+# Main logic
+
+def desired_tree(video_map, source_index, hidden_channels, only_ids=None):
+    """
+    Computes where every linkable video should appear in the organized tree.
+    Returns {rel_path: link} where rel_path is "<channel>/<date - title>/video.<ext>",
+    relative to TARGET_DIR or HIDDEN_DIR depending on the link's hidden flag.
+    """
+    desired = {}
+    ids = source_index.keys() if only_ids is None else only_ids
+    for video_id in ids:
+        source_file = source_index.get(video_id)
+        meta = video_map.get(video_id)
+        if not source_file or not meta:
+            continue
+        channel = sanitize(meta["channel_name"])
+        folder = f"{meta['published']} - {sanitize(meta['title'])}"
+        rel = f"{channel}/{folder}/video{source_file['suffix']}"
+        if rel in desired:
+            log(f"   ⚠️ {video_id} collides with {desired[rel]['video_id']} at {rel}, skipping")
+            continue
+        desired[rel] = {
+            "video_id": video_id,
+            "rel": rel,
+            "channel": channel,
+            "folder": folder,
+            "hidden": meta["channel_name"] in hidden_channels,
+            "target": str(HOST_SOURCE_DIR / source_file["path"].relative_to(SOURCE_DIR)),
+            "meta": meta
+        }
+    return desired
+
+def list_channels(root):
+    """Names of the channel folders directly under a root."""
+    if not root.exists():
+        return set()
+    with os.scandir(root) as it:
+        return {entry.name for entry in it if entry.is_dir(follow_symlinks=False)}
+
+def read_actual_tree():
+    """
+    Walks TARGET_DIR and HIDDEN_DIR once and records what is on disk:
+    channel folders per root, existing folders and every video.* entry with
+    its symlink target (None for real files). Paths are root-relative so a
+    channel that sits in the wrong root still matches its desired links.
+    """
+    actual = {"channels": {}, "dirs": set(), "links": {}}
+    for root in (TARGET_DIR, HIDDEN_DIR):
+        channels = list_channels(root)
+        actual["channels"][root] = channels
+        for channel in channels:
+            actual["dirs"].add(channel)
+            try:
+                with os.scandir(root / channel) as it:
+                    folders = [entry.name for entry in it if entry.is_dir(follow_symlinks=False)]
+            except OSError:
+                continue
+            for folder in folders:
+                actual["dirs"].add(f"{channel}/{folder}")
+                try:
+                    with os.scandir(root / channel / folder) as it:
+                        for entry in it:
+                            if not entry.name.startswith("video."):
+                                continue
+                            target = os.readlink(entry.path) if entry.is_symlink() else None
+                            actual["links"].setdefault(f"{channel}/{folder}/{entry.name}", {"path": entry.path, "target": target})
+                except OSError:
+                    continue
+    return actual
+
+def read_actual_links(desired, recorded):
+    """
+    Like read_actual_tree(), but only looks at the paths that matter for an
+    incremental sync: the desired links and the links recorded for the same
+    videos. recorded is {video_id: symlink path}.
+    """
+    actual = {"channels": {}, "dirs": set(), "links": {}}
+    candidates = {}
+    for root in (TARGET_DIR, HIDDEN_DIR):
+        actual["channels"][root] = list_channels(root)
+        for rel, link in desired.items():
+            candidates.setdefault(rel, []).append(root / rel)
+            for dir_rel in (link["channel"], f"{link['channel']}/{link['folder']}"):
+                if (root / dir_rel).is_dir():
+                    actual["dirs"].add(dir_rel)
+    for symlink in recorded.values():
+        path = Path(symlink)
+        for root in (TARGET_DIR, HIDDEN_DIR):
+            try:
+                candidates.setdefault(str(path.relative_to(root)), []).append(path)
+            except ValueError:
+                continue
+    for rel, paths in candidates.items():
+        for path in paths:
+            try:
+                actual["links"][rel] = {"path": str(path), "target": os.readlink(path)}
+                break
+            except OSError:
+                if os.path.lexists(path):
+                    actual["links"][rel] = {"path": str(path), "target": None}
+                    break
+    return actual
+
+def plan_tree(desired, actual, hidden_channels, complete, forget=None):
+    """
+    Diffs the desired tree against the actual one and returns the minimal
+    list of operations to reconcile them:
+      move   - channel folder in the wrong root (hidden status changed)
+      mkdir  - missing channel or video folder
+      link   - missing symlink
+      relink - symlink pointing somewhere else
+      remove - stale symlink of a video that is now linked elsewhere
+               (or, for forget={video_id: symlink}, whose source is gone)
+    Stale links are only removed when the metadata is complete.
+    """
+    sanitized_hidden = {sanitize(name) for name in hidden_channels}
+
+    def root_for(channel):
+        return HIDDEN_DIR if channel in sanitized_hidden else TARGET_DIR
+
+    ops = []
+    counts = {"verified": 0, "conflicts": 0}
+
+    # 1. Channel folders in the wrong root
+    for root, other in ((TARGET_DIR, HIDDEN_DIR), (HIDDEN_DIR, TARGET_DIR)):
+        for channel in sorted(actual["channels"].get(root, ())):
+            if root_for(channel) != root:
+                ops.append({"op": "move", "src": str(root / channel), "dest": str(other / channel),
+                            "merge": channel in actual["channels"].get(other, ())})
+
+    # 2. Missing folders and links
+    made = set()
+    rows = []
+    for rel, link in desired.items():
+        root = HIDDEN_DIR if link["hidden"] else TARGET_DIR
+        for dir_rel in (link["channel"], f"{link['channel']}/{link['folder']}"):
+            if dir_rel not in actual["dirs"] and dir_rel not in made:
+                made.add(dir_rel)
+                ops.append({"op": "mkdir", "path": str(root / dir_rel)})
+        current = actual["links"].get(rel)
+        if current is None:
+            ops.append({"op": "link", "path": str(root / rel), "target": link["target"], "video_id": link["video_id"]})
+        elif current["target"] is None:
+            # A real file where the link should go. Never replace it.
+            counts["conflicts"] += 1
+            continue
+        elif os.path.normpath(current["target"]) != os.path.normpath(link["target"]):
+            ops.append({"op": "relink", "path": str(root / rel), "target": link["target"], "video_id": link["video_id"]})
+        else:
+            counts["verified"] += 1
+        rows.append(link)
+
+    # 3. Stale links
+    if complete:
+        desired_ids = {link["video_id"] for link in desired.values()}
+        for rel, current in actual["links"].items():
+            if rel in desired or current["target"] is None:
+                continue
+            if Path(current["target"]).stem in desired_ids:
+                channel = rel.split("/", 1)[0]
+                ops.append({"op": "remove", "path": str(root_for(channel) / rel)})
+    forget = forget or {}
+    for video_id, symlink in forget.items():
+        ops.append({"op": "remove", "path": symlink, "video_id": video_id})
+
+    for op in ops:
+        counts[op["op"]] = counts.get(op["op"], 0) + 1
+    return {"ops": ops, "rows": rows, "forget": list(forget), "counts": counts, "complete": complete}
+
+def plan_summary(plan):
+    """One-line summary of a plan's counts."""
+    counts = plan["counts"]
+    return ", ".join(f"{name}: {counts.get(name, 0)}" for name in
+                     ("move", "mkdir", "link", "relink", "remove", "verified", "conflicts"))
+
+def print_plan(plan):
+    """Prints every planned operation, then the counts (for --dry-run)."""
+    for op in plan["ops"]:
+        if op["op"] == "move":
+            print(f"MOVE   {op['src']} -> {op['dest']}{' (merge)' if op['merge'] else ''}")
+        elif op["op"] in ("link", "relink"):
+            print(f"{op['op'].upper():<6} {op['path']} -> {op['target']}")
+        else:
+            print(f"{op['op'].upper():<6} {op['path']}")
+    print(f"Plan: {plan_summary(plan)}")
+    if not plan["complete"]:
+        print("Metadata was incomplete: stale links would be kept.")
+
+def move_channel(src, dest, merge):
+    """Moves a channel folder to the other root, merging into an existing one."""
+    if not merge and not dest.exists():
+        shutil.move(str(src), str(dest))
+        return
+    # Destination exists. We must merge, moving items one by one.
+    # Conflicting items are skipped; the plan re-verifies them on the next scan.
+    for item in src.iterdir():
+        dest_item = dest / item.name
+        if not dest_item.exists():
+            shutil.move(str(item), str(dest_item))
+    try:
+        src.rmdir()
+    except OSError:
+        log(f"   ⚠️ Could not remove old dir {src} (not empty?)")
+
+def apply_plan(plan, conn, batch_size=500, checkpoint=None):
+    """
+    Executes a plan's operations in batches (moves first, so later paths are
+    valid), then records the linked videos. Returns per-op counts of what was
+    actually done. checkpoint(done=n) is called before each operation and
+    may raise ScanCancelled to stop early. Videos whose link, folder or
+    channel move failed are not recorded as linked.
+    """
+    done = {}
+    errors = 0
+    failed_ids = set()
+    failed_dirs = []
+    ops = plan["ops"]
+    for start in range(0, len(ops), batch_size):
+        for i, op in enumerate(ops[start:start + batch_size], start):
+            if checkpoint:
+                checkpoint(done=i)
             try:
-                os.link(src_path, dest_video)
-                log("   🔗 Hardlinked video file.")
-            except OSError:
-                shutil.copy2(src_path, dest_video)
-                log("   📂 Copied video file.")
-                
-        except Exception as e:
-            return False, f"Failed to move video: {e}"
-            
-        return True, "Ready for import"
-        
-    except Exception as e:
-        log(f"   ❌ Recovery failed: {e}")
-        return False, str(e)
+                if op["op"] == "move":
+                    log(f"   [MOVE] {Path(op['src']).name} -> {Path(op['dest']).parent.name}")
+                    move_channel(Path(op["src"]), Path(op["dest"]), op["merge"])
+                elif op["op"] == "mkdir":
+                    os.makedirs(op["path"], exist_ok=True)
+                elif op["op"] == "link":
+                    os.symlink(op["target"], op["path"])
+                    log(f"   [NEW] Linked: {Path(op['path']).parent.name}")
+                elif op["op"] == "relink":
+                    os.unlink(op["path"])
+                    os.symlink(op["target"], op["path"])
+                    log(f"   [FIX] Relinked: {Path(op['path']).parent.name}")
+                elif op["op"] == "remove":
+                    path = Path(op["path"])
+                    if path.is_symlink():
+                        path.unlink()
+                        log(f"   [DEL] Unlinked: {path.parent.name}")
+                    try:
+                        path.parent.rmdir()
+                    except OSError:
+                        pass
+                done[op["op"]] = done.get(op["op"], 0) + 1
+            except Exception as e:
+                errors += 1
+                log(f"   ❌ {op['op']} failed for {op.get('path') or op.get('src')}: {e}")
+                if op["op"] in ("link", "relink"):
+                    failed_ids.add(op["video_id"])
+                elif op["op"] in ("mkdir", "move"):
+                    failed_dirs.append(op.get("dest") or op["path"])
+        if len(ops) > batch_size:
+            log(f"   - Applied {min(start + batch_size, len(ops))}/{len(ops)} operations")
+
+    rows = plan["rows"]
+    if failed_ids or failed_dirs:
+        def linked(link):
+            path = str((HIDDEN_DIR if link["hidden"] else TARGET_DIR) / link["rel"])
+            return link["video_id"] not in failed_ids and not any(
+                path.startswith(d.rstrip("/") + "/") for d in failed_dirs)
+        rows = [link for link in rows if linked(link)]
+
+    before = conn.total_changes
+    record_links(conn, rows)
+    # A failed relink has already removed the old link
+    for chunk in chunked(list(failed_ids)):
+        conn.executemany("UPDATE videos SET status = 'missing' WHERE video_id = ? AND status = 'linked'",
+                         [(video_id,) for video_id in chunk])
+    for chunk in chunked(plan["forget"]):
+        conn.executemany("DELETE FROM videos WHERE video_id = ?", [(video_id,) for video_id in chunk])
+    conn.commit()
+    if conn.total_changes != before:
+        bump_library_version()
+    done["errors"] = errors
+    return done
+
+def record_links(conn, links):
+    """
+    Upserts linked videos in executemany chunks, committing after each chunk
+    so readers never wait on one scan-long transaction. Rows that are already
+    up to date are not rewritten.
+    """
+    for chunk in chunked(links):
+        conn.executemany("""
+            INSERT INTO videos (video_id, title, channel, published, symlink, status, last_updated)
+            VALUES (?, ?, ?, ?, ?, 'linked', CURRENT_TIMESTAMP)
+            ON CONFLICT(video_id) DO UPDATE SET
+                title = excluded.title, channel = excluded.channel, published = excluded.published,
+                symlink = excluded.symlink, status = 'linked', last_updated = CURRENT_TIMESTAMP
+            WHERE title IS NOT excluded.title OR channel IS NOT excluded.channel
+               OR published IS NOT excluded.published OR symlink IS NOT excluded.symlink
+               OR status IS NOT 'linked'
+        """, [(link["video_id"], link["meta"]["title"], link["meta"]["channel_name"], link["meta"]["published"],
+               str((HIDDEN_DIR if link["hidden"] else TARGET_DIR) / link["rel"])) for link in chunk])
+        conn.commit()
 
-# Main logic
+def prune_link_records(conn, keep_ids):
+    """Deletes 'linked' rows for videos that are no longer linked. Returns how many."""
+    stale = [row["video_id"] for row in conn.execute("SELECT video_id FROM videos WHERE status = 'linked'")
+             if row["video_id"] not in keep_ids]
+    for chunk in chunked(stale):
+        conn.executemany("DELETE FROM videos WHERE video_id = ?", [(video_id,) for video_id in chunk])
+        conn.commit()
+    return len(stale)
 
-def process_videos():
-    global processed_videos
-    processed_videos = []
-    
-    # 1. Fetch all metadata first
-    video_map = fetch_all_metadata()
-    
-    # Get hidden channels
-    hidden_channels = set()
+def hidden_channel_names():
+    """Channel names the user has hidden."""
     with get_db() as conn:
-        rows = conn.execute("SELECT channel_name FROM hidden_channels").fetchall()
-        hidden_channels = {row["channel_name"] for row in rows}
+        return {row["channel_name"] for row in conn.execute("SELECT channel_name FROM hidden_channels")}
+
+def no_checkpoint(phase=None, **progress):
+    pass
+
+def plan_library(checkpoint=no_checkpoint):
+    """Fetches metadata, indexes the source tree and plans a full reconcile."""
+    checkpoint("metadata")
+    video_map, complete = metadata_snapshot.get()
+    hidden_channels = hidden_channel_names()
+    checkpoint("indexing")
+    indexed = 0
+    def channel_done(channel_path, found):
+        nonlocal indexed
+        indexed += 1
+        checkpoint(done=indexed, stop=False)
+    source_index = build_source_index(on_channel=channel_done)
+    checkpoint("planning")
+    desired = desired_tree(video_map, source_index, hidden_channels)
+    log("🧭 Reading organized tree...")
+    plan = plan_tree(desired, read_actual_tree(), hidden_channels, complete)
+    log(f"🧭 Plan: {plan_summary(plan)}")
+    return plan
+
+def process_videos(checkpoint=no_checkpoint):
+    """
+    Runs a full scan. Call it through request_scan(), which keeps scans from
+    overlapping; checkpoint(phase, done=, total=) reports progress and raises
+    ScanCancelled when the scan should stop.
+    """
+    global processed_videos
+    # tree_lock keeps watcher syncs from interleaving with a full scan
+    with tree_lock:
+        # Ensure hidden directory exists
+        HIDDEN_DIR.mkdir(parents=True, exist_ok=True)
+        checkpoint("cleanup")
+        cleanup_old_folders()
 
-    # Ensure hidden directory exists
-    HIDDEN_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # 2. Run cleanup (On both target and hidden)
-    # We need to adapt cleanup to handle hidden too, or just run it on both explicitly if we update the function
-    # Let's keep it simple for now and rely on logic below to move things
+        plan = plan_library(checkpoint)
 
-    cleanup_old_folders()
+        checkpoint("applying", total=len(plan["ops"]))
+        with get_db() as conn:
+            try:
+                done = apply_plan(plan, conn, checkpoint=checkpoint)
+                # Drop records of videos that are no longer linked.
+                # With partial metadata we keep them: missing entries may just be unfetched pages.
+                if plan["complete"]:
+                    checkpoint("pruning")
+                    pruned = prune_link_records(conn, {link["video_id"] for link in plan["rows"]})
+                    if pruned:
+                        log(f"   - Removed {pruned} stale link records")
+                        bump_library_version()
+                else:
+                    log("⚠️ Metadata incomplete, keeping existing link records.")
+            except ScanCancelled:
+                # Applied operations stay; the next scan verifies them and records the links
+                conn.rollback()
+                raise
+            except Exception as e:
+                conn.rollback()
+                return str(e)
+
+        processed_videos = [{
+            "video_id": link["video_id"],
+            "title": link["meta"]["title"],
+            "channel": link["meta"]["channel_name"],
+            "published": link["meta"]["published"],
+            "symlink": str((HIDDEN_DIR if link["hidden"] else TARGET_DIR) / link["rel"])
+        } for link in plan["rows"]]
 
-    # 3. Enforce Hidden Logic (Independent of Source)
-    # This ensures that even if files aren't in source (e.g. preserved in target), they still get moved.
-    log("🙈 Enforcing hidden channel status...")
-    
-    # Move Hidden FROM Target TO Hidden
-    if TARGET_DIR.exists():
-        for channel_dir in TARGET_DIR.iterdir():
-            if not channel_dir.is_dir(): continue
-            
-            # We need to match the folder name to the channel name.
-            # Since folder names are sanitized, we might not know the original name easily.
-            # BUT, we can check if the folder name *matches the sanitized version* of any hidden channel.
-            
-            # Optimization: Create a set of sanitized hidden names
-            sanitized_hidden = {sanitize(name) for name in hidden_channels}
-            
-            if channel_dir.name in sanitized_hidden:
-                # It is hidden, but in target! Move it.
-                dest = HIDDEN_DIR / channel_dir.name
-                try:
-                    log(f"   [MOVE] Found hidden channel in Public: {channel_dir.name}")
-                    if not dest.exists():
-                        shutil.move(str(channel_dir), str(dest))
-                        log(f"   ---> Moved to Hidden")
-                    else:
-                        # Merge logic
-                        for item in channel_dir.iterdir():
-                            dest_item = dest / item.name
-                            if not dest_item.exists():
-                                shutil.move(str(item), str(dest_item))
-                        try:
-                            channel_dir.rmdir()
-                            log(f"   ---> Merged to Hidden")
-                        except:
-                            log(f"   ---> Merged to Hidden (Old dir not empty)")
-                except Exception as e:
-                    log(f"   ❌ Error moving {channel_dir.name}: {e}")
-
-    # Move Public FROM Hidden TO Target
-    if HIDDEN_DIR.exists():
-        for channel_dir in HIDDEN_DIR.iterdir():
-            if not channel_dir.is_dir(): continue
-            
-            # Optimization: Create a set of sanitized hidden names
-            sanitized_hidden = {sanitize(name) for name in hidden_channels}
-            
-            if channel_dir.name not in sanitized_hidden:
-                # It is NOT hidden, but needs to be in Public!
-                dest = TARGET_DIR / channel_dir.name
-                try:
-                    log(f"   [MOVE] Found public channel in Hidden: {channel_dir.name}")
-                    if not dest.exists():
-                        shutil.move(str(channel_dir), str(dest))
-                        log(f"   ---> Moved to Public")
-                    else:
-                        # Merge logic
-                        for item in channel_dir.iterdir():
-                            dest_item = dest / item.name
-                            if not dest_item.exists():
-                                shutil.move(str(item), str(dest_item))
-                        try:
-                            channel_dir.rmdir()
-                            log(f"   ---> Merged to Public")
-                        except:
-                            log(f"   ---> Merged to Public (Old dir not empty)")
-                except Exception as e:
-                    log(f"   ❌ Error moving {channel_dir.name}: {e}")
-    
-    # Statistics
-    new_links = 0
-    verified_links = 0
-    
-    with get_db() as conn:
-        # Clear existing "linked" videos (we'll repopulate)
-        conn.execute("DELETE FROM videos WHERE status = 'linked'")
-        
+    log(f"✅ Scan complete. Processed {len(processed_videos)} videos.")
+    log(f"   - New/Fixed Links: {done.get('link', 0) + done.get('relink', 0)}")
+    log(f"   - Verified Links:  {plan['counts']['verified']}")
+    if done["errors"]:
+        log(f"   - Failed operations: {done['errors']}")
+    return None
+
+# Scan coordinator
+# Manual, scheduled and watcher full scans all go through request_scan(): one
+# scan runs at a time, and requests that arrive meanwhile are folded into a
+# single follow-up run. Scans stop at the next checkpoint when cancelled or
+# once SCAN_TIME_BUDGET runs out.
+
+class ScanCancelled(Exception):
+    pass
+
+SCAN = {
+    "status": "idle", # idle, running, done, cancelled, error
+    "phase": None, # cleanup, metadata, indexing, planning, applying, pruning
+    "trigger": None, # manual, scheduled, watcher
+    "done": 0,
+    "total": 0,
+    "pending": False, # A follow-up scan is queued
+    "pending_trigger": None,
+    "started": None,
+    "finished": None,
+    "error": None
+}
+scan_lock = threading.Lock()
+scan_cancel = threading.Event()
+scan_deadline = None
+
+def scan_checkpoint(phase=None, done=None, total=None, stop=True):
+    """Records scan progress and raises ScanCancelled once the scan is cancelled or out of time."""
+    if phase:
+        SCAN.update(phase=phase, done=0, total=0)
+    if done is not None:
+        SCAN["done"] = done
+    if total is not None:
+        SCAN["total"] = total
+    if not stop:
+        return
+    if scan_cancel.is_set():
+        raise ScanCancelled("Cancelled")
+    if scan_deadline and time.time() > scan_deadline:
+        raise ScanCancelled(f"Time budget of {SCAN_TIME_BUDGET} minutes exceeded")
+
+def run_scans(trigger):
+    """Runs the requested scan, then the coalesced follow-up while one is pending."""
+    global scan_deadline
+    while True:
+        scan_deadline = time.time() + SCAN_TIME_BUDGET * 60 if SCAN_TIME_BUDGET > 0 else None
         try:
-            for channel_path in SOURCE_DIR.iterdir():
-                if not channel_path.is_dir():
-                    continue
-                for video_file in channel_path.glob("*.*"):
-                    video_id = video_file.stem
-                    
-                    # Lookup in local map
-                    meta = video_map.get(video_id)
-                    if not meta:
-                        continue
-                    sanitized_channel_name = sanitize(meta["channel_name"])
-                
-                # Determine target root
-                is_hidden = meta["channel_name"] in hidden_channels
-                target_root = HIDDEN_DIR if is_hidden else TARGET_DIR
-                other_root = TARGET_DIR if is_hidden else HIDDEN_DIR
-                
-                # Check if channel exists in the WRONG place and MOVE it (Migration/Toggle)
-                wrong_channel_dir = other_root / sanitized_channel_name
-                correct_channel_dir = target_root / sanitized_channel_name
+            error = process_videos(scan_checkpoint)
+            status = "error" if error else "done"
+        except ScanCancelled as e:
+            log(f"⏹️ Scan stopped during {SCAN['phase']}: {e}")
+            status, error = "cancelled", str(e)
+        except Exception as e:
+            log(f"❌ Scan failed: {e}")
+            status, error = "error", str(e)
+        with scan_lock:
+            SCAN.update(status=status, error=error, finished=datetime.now().isoformat())
+            if not SCAN["pending"]:
+                return
+            trigger = SCAN["pending_trigger"]
+            scan_cancel.clear()
+            SCAN.update(status="running", phase=None, trigger=trigger, done=0, total=0, pending=False,
+                        pending_trigger=None, started=datetime.now().isoformat(), finished=None, error=None)
+        log(f"🔄 Running queued {trigger} scan...")
+
+def request_scan(trigger="manual"):
+    """
+    Starts a full scan in the background. If one is already running, a
+    single follow-up is queued instead. Returns "started" or "queued".
+    """
+    with scan_lock:
+        if SCAN["status"] == "running":
+            SCAN["pending"] = True
+            SCAN["pending_trigger"] = SCAN["pending_trigger"] or trigger
+            return "queued"
+        scan_cancel.clear()
+        SCAN.update(status="running", phase=None, trigger=trigger, done=0, total=0, pending=False,
+                    pending_trigger=None, started=datetime.now().isoformat(), finished=None, error=None)
+    threading.Thread(target=run_scans, args=(trigger,), daemon=True).start()
+    return "started"
+
+def cancel_scan():
+    """Asks the running scan to stop and drops a queued follow-up. Returns False if none is running."""
+    with scan_lock:
+        if SCAN["status"] != "running":
+            return False
+        SCAN.update(pending=False, pending_trigger=None)
+        scan_cancel.set()
+    return True
 
-                # DEBUG LOGGING (Temporary)
-                if meta["channel_name"] in hidden_channels:
-                     log(f"DEBUG: Checking {meta['channel_name']} (Hidden). Wrong Dir: {wrong_channel_dir}, Exists? {wrong_channel_dir.exists()}")
+# Library watcher
 
-                
-                if wrong_channel_dir.exists():
-                    try:
-                        # If destination already exists, we have a conflict.
-                        # Strategy: Merge move?
-                        # Simplest robust way: 
-                        # 1. Ensure dest exists
-                        # 2. Move contents?
-                        # Or just shutil.move(src, dst) which works if dst doesn't exist.
-                        
-                        if not correct_channel_dir.exists():
-                            shutil.move(str(wrong_channel_dir), str(correct_channel_dir))
-                            log(f"   [MOVE] Moved {sanitized_channel_name} to {target_root.name} (Status Change)")
-                        else:
-                            # Destination exists. We must merge.
-                            # Move items one by one.
-                            for item in wrong_channel_dir.iterdir():
-                                dest_item = correct_channel_dir / item.name
-                                if not dest_item.exists():
-                                    shutil.move(str(item), str(dest_item))
-                                else:
-                                    # Conflict. If it's a folder, we could recurse, but let's just log warning and skip?
-                                    # If it's a file/symlink, we skip (it will be regenerated/verified later by the loop)
-                                    pass
-                            
-                            # Now remove the empty source dir
-                            try:
-                                wrong_channel_dir.rmdir() 
-                            except OSError:
-                                log(f"   ⚠️ Could not remove old dir {wrong_channel_dir} (not empty?)")
+METADATA_MISSES = {} # video_id -> when a re-sync with TA last failed to find it
 
-                    except Exception as e:
-                        log(f"   ❌ Failed to move {sanitized_channel_name} from old location: {e}")
-
-                channel_dir = target_root / sanitized_channel_name
-                channel_dir.mkdir(parents=True, exist_ok=True)
-                sanitized_title = sanitize(meta["title"])
-                folder_name = f"{meta['published']} - {sanitized_title}"
-                video_dir = channel_dir / folder_name
-                video_dir.mkdir(parents=True, exist_ok=True)
-                actual_file = next(channel_path.glob(f"{video_id}.*"), None)
-                if not actual_file:
-                    continue
-                host_path_root = Path("/mnt/user/tubearchives/bp")
-                host_source_path = host_path_root / actual_file.relative_to(SOURCE_DIR)
-                dest_file = video_dir / f"video{actual_file.suffix}"
-                try:
-                    if dest_file.exists():
-                        if dest_file.is_symlink():
-                            current_target = Path(os.readlink(dest_file))
-                            if current_target.resolve() != host_source_path.resolve():
-                                dest_file.unlink()
-                                os.symlink(host_source_path, dest_file)
-                                log(f"   [FIX] Relinked: {folder_name}")
-                                new_links += 1
-                            else:
-                                verified_links += 1
-                        else:
-                            # It's a file or something else, replace it? No, unsafe.
-                            pass
-                    else:
-                        os.symlink(host_source_path, dest_file)
-                        log(f"   [NEW] Linked: {folder_name}")
-                        new_links += 1
-                except Exception:
-                    pass
-                
-                # Store in database
-                conn.execute("""
-                    INSERT OR REPLACE INTO videos 
-                    (video_id, title, channel, published, symlink, status)
-                    VALUES (?, ?, ?, ?, ?, 'linked')
-                """, (video_id, meta["title"], meta["channel_name"], 
-                        meta["published"], str(dest_file)))
-                
-                processed_videos.append({
-                    "video_id": video_id,
-                    "title": meta["title"],
-                    "channel": meta["channel_name"],
-                    "published": meta["published"],
-                    "symlink": str(dest_file)
-                })
+def sync_video_ids(video_ids, channel_paths=()):
+    """
+    Incremental counterpart of process_videos(): refreshes the source index for
+    the given source channel folders, then plans and applies changes for only
+    the given video IDs. Videos whose source file is gone are unlinked.
+    """
+    global SOURCE_INDEX
+    event_ids = set(video_ids)
+    with tree_lock:
+        hidden_channels = hidden_channel_names()
+
+        index = dict(SOURCE_INDEX)
+        for channel_path in channel_paths:
+            fresh = scan_source_channel(channel_path)
+            gone = [v for v, e in index.items() if str(e["path"].parent) == str(channel_path) and v not in fresh]
+            for vid_id in gone:
+                del index[vid_id]
+            index.update(fresh)
+            video_ids = set(video_ids) | set(fresh) | set(gone)
+        SOURCE_INDEX = index
+
+        video_map, complete = metadata_snapshot.get()
+        # Only the changed files themselves can trigger a re-sync: the rest of a
+        # rescanned channel may hold unindexed videos TA will never know about.
+        # Files TA didn't know at the last re-sync wait for the snapshot to expire.
+        now = time.time()
+        unknown = {vid_id for vid_id in event_ids if vid_id in index and vid_id not in video_map
+                   and now - METADATA_MISSES.get(vid_id, 0) >= METADATA_TTL}
+        if unknown:
+            # New downloads TA indexed after the snapshot was taken
+            metadata_snapshot.invalidate()
+            video_map, complete = metadata_snapshot.get()
+            for vid_id in unknown:
+                if vid_id in video_map:
+                    METADATA_MISSES.pop(vid_id, None)
+                else:
+                    METADATA_MISSES[vid_id] = now
+
+        with get_db() as conn:
+            recorded = {}
+            for vid_id in video_ids:
+                row = conn.execute("SELECT symlink FROM videos WHERE video_id = ? AND status = 'linked'", (vid_id,)).fetchone()
+                if row and row["symlink"]:
+                    recorded[vid_id] = row["symlink"]
+            forget = {vid_id: symlink for vid_id, symlink in recorded.items() if vid_id not in index}
+            desired = desired_tree(video_map, index, hidden_channels, only_ids=video_ids)
+            plan = plan_tree(desired, read_actual_links(desired, recorded), hidden_channels, complete, forget=forget)
+            done = apply_plan(plan, conn)
+            conn.commit()
+
+    log(f"👀 Synced {len(video_ids)} changed videos. {plan_summary(plan)}, errors: {done['errors']}")
+
+def ids_under(path):
+    """Video IDs whose recorded symlink lives under a target path."""
+    with get_db() as conn:
+        rows = conn.execute("SELECT video_id FROM videos WHERE symlink LIKE ?", (f"{path}/%",)).fetchall()
+    return {row["video_id"] for row in rows}
+
+def inotify_events():
+    """
+    Yields batches of change events using Linux inotify (via ctypes).
+    Source channel folders are watched for file changes; target and hidden
+    channel folders for removed or renamed video folders.
+    Events are ("source", channel_path, name), ("target", parent, name) or
+    ("rescan", None, None) when the kernel queue overflowed.
+    """
+    import ctypes
+    import select
+    import struct
+
+    IN_MOVED_FROM, IN_MOVED_TO = 0x40, 0x80
+    IN_CLOSE_WRITE, IN_CREATE, IN_DELETE = 0x8, 0x100, 0x200
+    IN_ISDIR, IN_Q_OVERFLOW = 0x40000000, 0x4000
+    SOURCE_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    TARGET_MASK = IN_DELETE | IN_MOVED_FROM
+    ROOT_MASK = IN_CREATE | IN_MOVED_TO | IN_ISDIR
+
+    libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    watches = {}  # wd -> (kind, path)
+
+    def add_watch(kind, path, mask):
+        wd = libc.inotify_add_watch(fd, str(path).encode(), mask)
+        if wd < 0:
+            log(f"   ⚠️ Cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+            return
+        watches[wd] = (kind, Path(path))
+
+    add_watch("source_root", SOURCE_DIR, ROOT_MASK)
+    for channel_dir in SOURCE_DIR.iterdir():
+        if channel_dir.is_dir():
+            add_watch("source", channel_dir, SOURCE_MASK)
+    for root in (TARGET_DIR, HIDDEN_DIR):
+        if not root.exists():
+            continue
+        add_watch("target_root", root, TARGET_MASK | ROOT_MASK)
+        for channel_dir in root.iterdir():
+            if channel_dir.is_dir():
+                add_watch("target", channel_dir, TARGET_MASK)
+    log(f"👀 inotify watching {len(watches)} folders.")
+
+    try:
+        while True:
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            batch = []
+            if ready:
+                data = os.read(fd, 65536)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+                    name = data[offset + 16:offset + 16 + length].rstrip(b"\0").decode(errors="replace")
+                    offset += 16 + length
+                    if mask & IN_Q_OVERFLOW:
+                        batch.append(("rescan", None, None))
+                        continue
+                    kind, path = watches.get(wd, (None, None))
+                    if kind == "source_root" and mask & IN_ISDIR:
+                        # New channel folder: watch it and sync whatever it already holds
+                        add_watch("source", path / name, SOURCE_MASK)
+                        batch.append(("source", path / name, None))
+                    elif kind == "source":
+                        batch.append(("source", path, name))
+                    elif kind == "target_root" and mask & (IN_CREATE | IN_MOVED_TO):
+                        add_watch("target", path / name, TARGET_MASK)
+                    elif kind in ("target", "target_root"):
+                        batch.append(("target", path, name))
+            yield batch
+    finally:
+        os.close(fd)
+
+def poll_events():
+    """
+    Polling fallback for filesystems without inotify (e.g. SMB mounts).
+    Compares folder mtimes every WATCH_POLL_INTERVAL seconds and only lists
+    the folders that changed. Yields the same events as inotify_events().
+    """
+    def channel_mtimes(root):
+        mtimes = {}
+        if root.exists():
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        mtimes[entry.path] = entry.stat().st_mtime
+        return mtimes
+
+    def snapshot(path):
+        with os.scandir(path) as it:
+            return {entry.name: entry.stat(follow_symlinks=False).st_mtime for entry in it}
+
+    source = channel_mtimes(SOURCE_DIR)
+    files = {path: snapshot(path) for path in source}
+    targets = {}
+    for root in (TARGET_DIR, HIDDEN_DIR):
+        targets.update(channel_mtimes(root))
+    folders = {path: set(snapshot(path)) for path in targets}
+
+    while True:
+        time.sleep(WATCH_POLL_INTERVAL)
+        batch = []
+        current = channel_mtimes(SOURCE_DIR)
+        for path, mtime in current.items():
+            if path in source and source[path] == mtime:
+                continue
+            try:
+                fresh = snapshot(path)
+            except OSError:
+                continue
+            old = files.get(path, {})
+            for name in set(fresh) | set(old):
+                if fresh.get(name) != old.get(name):
+                    batch.append(("source", Path(path), name))
+            files[path] = fresh
+        for path in set(source) - set(current):
+            batch.append(("source", Path(path), None))
+            files.pop(path, None)
+        source = current
+
+        current = {}
+        for root in (TARGET_DIR, HIDDEN_DIR):
+            current.update(channel_mtimes(root))
+        for path, mtime in current.items():
+            if targets.get(path) == mtime:
+                continue
+            try:
+                fresh = set(snapshot(path))
+            except OSError:
+                continue
+            for name in folders.get(path, set()) - fresh:
+                batch.append(("target", Path(path), name))
+            folders[path] = fresh
+        for path in set(targets) - set(current):
+            batch.append(("target", Path(path).parent, Path(path).name))
+            folders.pop(path, None)
+        targets = current
+        yield batch
+
+def watcher():
+    """
+    Watches SOURCE_DIR and TARGET_DIR and syncs only the affected videos.
+    Changes are debounced: a sync runs once WATCH_DEBOUNCE seconds pass
+    without new events, so a download finishing or a folder move is
+    handled in one go.
+    """
+    mode = WATCH_MODE
+    if mode in ("auto", "inotify"):
+        try:
+            events = inotify_events()
+            events = itertools.chain([next(events)], events)
+            mode = "inotify"
         except Exception as e:
-            conn.rollback()
-            return str(e)
-        
-        conn.commit()
-            
-    log(f"✅ Scan complete. Processed {len(processed_videos)} videos.")
-    log(f"   - New/Fixed Links: {new_links}")
-    log(f"   - Verified Links:  {verified_links}")
-    return None
+            if WATCH_MODE == "inotify":
+                log(f"❌ inotify unavailable ({e}), falling back to polling")
+            mode = "poll"
+    if mode == "poll":
+        events = poll_events()
+    log(f"👀 Watcher started ({mode}).")
+
+    pending_ids = set()
+    pending_channels = set()
+    last_event = 0
+    for batch in events:
+        for kind, path, name in batch:
+            if kind == "rescan":
+                log("⚠️ Watcher overflowed, running full scan.")
+                request_scan("watcher")
+                pending_ids.clear()
+                pending_channels.clear()
+                break
+            if kind == "source":
+                pending_channels.add(path)
+                if name:
+                    vid_id = extract_id_from_filename(name)
+                    if vid_id:
+                        pending_ids.add(vid_id)
+                else:
+                    pending_ids |= {v for v, e in SOURCE_INDEX.items() if str(e["path"].parent) == str(path)}
+            elif kind == "target":
+                pending_ids |= ids_under(path / name)
+            last_event = time.time()
+
+        if (pending_ids or pending_channels) and time.time() - last_event >= WATCH_DEBOUNCE:
+            try:
+                sync_video_ids(pending_ids, pending_channels)
+            except Exception as e:
+                log(f"❌ Watcher sync failed: {e}")
+            pending_ids = set()
+            pending_channels = set()
 
 def scheduler():
-    log(f"🕒 Background scheduler started. Scanning every {SCAN_INTERVAL} minutes.")
+    # With a watcher running, full scans are only a safety net
+    interval = SCAN_INTERVAL if WATCH_MODE == "off" else WATCH_FULL_SCAN_INTERVAL
+    log(f"🕒 Background scheduler started. Scanning every {interval} minutes.")
     while True:
         log("🔄 Running scheduled scan...")
-        process_videos()
-        time.sleep(SCAN_INTERVAL * 60)
+        if request_scan("scheduled") == "queued":
+            log("   - A scan is already running, queued a follow-up.")
+        time.sleep(interval * 60)
 
 # Flask routes
 
@@ -944,50 +3285,199 @@ def serve_static(path):
     # Only serve if file exists in static folder
     return send_from_directory(app.static_folder, path)
 
+@app.after_request
+def compress_response(response):
+    """Gzips JSON responses for clients that accept it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != "application/json"
+            or "Content-Encoding" in response.headers
+            or "gzip" not in request.headers.get("Accept-Encoding", "")):
+        return response
+    data = response.get_data()
+    if len(data) < 1024:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = len(response.get_data())
+    response.vary.add("Accept-Encoding")
+    return response
+
+STATUS_SORT_COLUMNS = {"published", "title", "channel", "status", "video_id", "last_updated"}
+
 @app.route("/api/status")
 @requires_auth
 def api_status():
+    """
+    Library stats plus one page of videos.
+    Query args: page, per_page (0 = stats only, max 1000), sort, order,
+    channel, status, date_from, date_to (YYYY-MM-DD), q (title / ID search),
+    channels=1 to include the channel list with counts.
+    """
+    # Answer 304 while the library hasn't changed since the client's copy
+    version = LIBRARY_VERSION
+    etag = f"lib-{version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 0), 1000)
+    sort = request.args.get('sort', 'published')
+    if sort not in STATUS_SORT_COLUMNS:
+        sort = 'published'
+    order = 'ASC' if request.args.get('order', 'desc').lower() == 'asc' else 'DESC'
+
+    where = []
+    params = []
+    if request.args.get('channel'):
+        where.append("channel = ?")
+        params.append(request.args['channel'])
+    if request.args.get('status'):
+        where.append("status = ?")
+        params.append(request.args['status'])
+    if request.args.get('date_from'):
+        where.append("published >= ?")
+        params.append(request.args['date_from'])
+    if request.args.get('date_to'):
+        where.append("published <= ?")
+        params.append(request.args['date_to'])
+    if request.args.get('q'):
+        where.append("(title LIKE ? OR video_id = ?)")
+        params.extend([f"%{request.args['q']}%", request.args['q']])
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
     with get_db() as conn:
-        # Get all videos from DB
-        videos = []
-        for row in conn.execute("SELECT * FROM videos ORDER BY channel, published DESC"):
-            videos.append({
-                "video_id": row["video_id"],
-                "title": row["title"],
-                "channel": row["channel"],
-                "published": row["published"],
-                "symlink": row["symlink"],
-                "status": row["status"]
-            })
-        
         # Calculate stats
-        total = len(videos)
-        linked = sum(1 for v in videos if v["status"] == "linked")
-        missing = sum(1 for v in videos if v["status"] == "missing")
-        
-        return jsonify({
-            "total_videos": total,
-            "verified_links": linked,
-            "missing_count": missing,
-            "videos": videos
-        })
+        counts = {row["status"]: row["n"] for row in
+                  conn.execute("SELECT status, COUNT(*) AS n FROM videos GROUP BY status")}
+        result = {
+            "total_videos": sum(counts.values()),
+            "verified_links": counts.get("linked", 0),
+            "missing_count": counts.get("missing", 0),
+            "counts": counts,
+            "version": version,
+            "page": page,
+            "per_page": per_page
+        }
+
+        if per_page:
+            filtered = conn.execute(f"SELECT COUNT(*) AS n FROM videos {where_sql}", params).fetchone()["n"]
+            videos = []
+            for row in conn.execute(
+                f"""SELECT video_id, title, channel, published, symlink, status FROM videos {where_sql}
+                    ORDER BY {sort} {order}, video_id LIMIT ? OFFSET ?""",
+                params + [per_page, (page - 1) * per_page]
+            ):
+                videos.append({
+                    "video_id": row["video_id"],
+                    "title": row["title"],
+                    "channel": row["channel"],
+                    "published": row["published"],
+                    "symlink": row["symlink"],
+                    "status": row["status"]
+                })
+            result.update({
+                "videos": videos,
+                "filtered_total": filtered,
+                "pages": (filtered + per_page - 1) // per_page
+            })
+
+        if request.args.get('channels'):
+            result["channels"] = [{"name": row["channel"], "count": row["n"]} for row in
+                                  conn.execute("SELECT channel, COUNT(*) AS n FROM videos GROUP BY channel ORDER BY channel")]
+
+    response = jsonify(result)
+    response.set_etag(etag)
+    # Make browsers revalidate with If-None-Match instead of reusing stale copies
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/status/wait")
+@requires_auth
+def api_status_wait():
+    """
+    Long-poll: blocks until the library version moves past `since`
+    or `timeout` seconds (max 60) pass. Returns the current version.
+    """
+    since = request.args.get('since', -1, type=int)
+    timeout = min(max(request.args.get('timeout', 30, type=float), 0), 60)
+    with library_changed:
+        library_changed.wait_for(lambda: LIBRARY_VERSION != since, timeout=timeout)
+        version = LIBRARY_VERSION
+    return jsonify({"version": version, "changed": version != since})
+
+def log_page(buffer):
+    """Lines from ?start=<seq> on. dropped counts lines that already fell out of the buffer."""
+    start = request.args.get('start', 0, type=int)
+    entries, next_seq, first = buffer.since(start)
+    return jsonify({
+        "logs": [msg for _, msg in entries],
+        "next_index": next_seq,
+        "dropped": max(first - start, 0)
+    })
+
+def log_stream(buffer):
+    """
+    Server-Sent Events stream of a log buffer. Each line is sent with its
+    sequence number as the event id, so a reconnecting EventSource resumes
+    from Last-Event-ID; ?since=<seq> sets the starting point for new clients.
+    """
+    last_id = request.headers.get("Last-Event-ID")
+    seq = int(last_id) + 1 if last_id and last_id.isdigit() else request.args.get('since', 0, type=int)
+
+    def generate(seq):
+        yield "retry: 3000\n\n"
+        while True:
+            entries, next_seq, _ = buffer.since(seq)
+            for entry_seq, msg in entries:
+                data = "".join(f"data: {line}\n" for line in str(msg).splitlines() or [""])
+                yield f"id: {entry_seq}\n{data}\n"
+            seq = next_seq
+            if not buffer.wait(seq, timeout=15):
+                yield ": keepalive\n\n"
+
+    return Response(generate(seq), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/logs")
 @requires_auth
 def api_logs():
-    start = request.args.get('start', 0, type=int)
-    with log_lock:
-        return jsonify({
-            "logs": log_buffer[start:],
-            "next_index": len(log_buffer)
-        })
+    return log_page(log_buffer)
+
+@app.route("/api/logs/stream")
+@requires_auth
+def api_logs_stream():
+    return log_stream(log_buffer)
 
 @app.route("/api/scan", methods=["POST"])
 @requires_auth
 def api_scan():
-    # Run in background to avoid blocking
-    threading.Thread(target=process_videos).start()
-    return jsonify({"status": "started"})
+    data = request.get_json(silent=True) or {}
+    if data.get("dry_run") or request.args.get("dry_run"):
+        # Plan only: report what a scan would do without touching the tree
+        plan = plan_library()
+        return jsonify({
+            "status": "planned",
+            "complete": plan["complete"],
+            "counts": plan["counts"],
+            "ops": plan["ops"][:1000],
+            "truncated": len(plan["ops"]) > 1000
+        })
+    # A manual scan should see TA's latest state
+    metadata_snapshot.invalidate()
+    # Runs in the background; a click during a running scan queues one follow-up
+    return jsonify({"status": request_scan("manual"), "scan": SCAN})
+
+@app.route("/api/scan/status", methods=["GET"])
+@requires_auth
+def api_scan_status():
+    return jsonify(SCAN)
+
+@app.route("/api/scan/cancel", methods=["POST"])
+@requires_auth
+def api_scan_cancel():
+    return jsonify({"cancelled": cancel_scan(), "scan": SCAN})
 
 @app.route("/api/cleanup", methods=["POST"])
 @requires_auth
@@ -995,122 +3485,336 @@ def api_cleanup():
     threading.Thread(target=cleanup_old_folders).start()
     return jsonify({"status": "started"})
 
-@app.route("/api/check-orphans", methods=["POST"])
+@app.route("/api/check-orphans", methods=["GET", "POST"])
 @requires_auth
 def api_check_orphans():
-    orphaned = check_orphaned_links()
-    return jsonify({"status": "complete", "orphaned": orphaned, "count": len(orphaned)})
+    """
+    POST starts a background orphan check ({"repair": false} to only report).
+    GET reports its progress plus the
+    broken links found after cursor `since`, so clients can fetch results
+    incrementally while the check runs.
+    """
+    if request.method == "POST":
+        started = start_orphan_check((request.get_json(silent=True) or {}).get("repair"))
+        return jsonify({"started": started, **ORPHAN_CHECK}), 202
+    since = max(request.args.get('since', 0, type=int), 0)
+    orphaned = ORPHAN_RESULTS[since:]
+    return jsonify({
+        **ORPHAN_CHECK,
+        "orphaned": orphaned,
+        "count": len(ORPHAN_RESULTS),
+        "remaining": ORPHAN_CHECK["broken"] - ORPHAN_CHECK["repaired"],
+        "next": since + len(orphaned)
+    })
 
 @app.route("/transcode")
 @requires_auth
 def transcode_page():
     return send_from_directory(app.static_folder, 'transcode/index.html')
 
+TRANSCODE_FILTERS = {
+    "any": ("full", "audio", "remux"),
+    "full": ("full",),
+    "audio": ("audio",),
+    "remux": ("remux",),
+    "error": ("error",)
+}
+
+def candidate_query(args):
+    """Builds the WHERE clause shared by the candidate list and enqueue-all."""
+    actions = TRANSCODE_FILTERS.get(args.get('need', 'any'), TRANSCODE_FILTERS["any"])
+    where = [f"m.action IN ({', '.join('?' * len(actions))})"]
+    params = list(actions)
+    if args.get('channel'):
+        where.append("m.channel = ?")
+        params.append(args['channel'])
+    if args.get('codec'):
+        where.append("(m.video_codec = ? OR m.audio_codec = ?)")
+        params += [args['codec'], args['codec']]
+    if args.get('q'):
+        where.append("(v.title LIKE ? OR m.path LIKE ?)")
+        params += [f"%{args['q']}%", f"%{args['q']}%"]
+    return " WHERE " + " AND ".join(where), params
+
 @app.route("/api/transcode/videos")
 @requires_auth
 def api_transcode_videos():
-    """Get all videos that need transcoding."""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 100, type=int)
+    """Get videos that need transcoding (filters: need=any|full|audio|remux|error, channel, codec, q)."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
     offset = (page - 1) * per_page
-    
+    where, params = candidate_query(request.args)
+    base = " FROM media_info m LEFT JOIN videos v ON v.video_id = m.video_id" + where
+
     with get_db() as conn:
-        # Get total count
-        total = conn.execute("SELECT COUNT(*) as count FROM videos WHERE status = 'missing'").fetchone()['count']
-        
+        total = conn.execute("SELECT COUNT(*) as count" + base, params).fetchone()['count']
+        counts = dict(conn.execute("SELECT action, COUNT(*) FROM media_info GROUP BY action").fetchall())
         videos = []
         for row in conn.execute(
-            "SELECT * FROM videos WHERE status = 'missing' LIMIT ? OFFSET ?",
-            (per_page, offset)
+            "SELECT m.*, v.title, v.published" + base + " ORDER BY m.channel, m.path LIMIT ? OFFSET ?",
+            params + [per_page, offset]
         ):
             videos.append({
                 "video_id": row["video_id"],
-                "title": row["title"],
+                "title": row["title"] or Path(row["path"]).stem,
                 "channel": row["channel"],
                 "published": row["published"],
-                "symlink": row["symlink"]
+                "filepath": row["path"],
+                "video_codec": row["video_codec"],
+                "audio_codec": row["audio_codec"],
+                "resolution": f"{row['width']}x{row['height']}" if row["width"] else None,
+                "duration": row["duration"],
+                "size": row["size"],
+                "action": row["action"]
             })
-        
+
         return jsonify({
             "videos": videos,
             "total": total,
+            "counts": counts,
             "page": page,
             "per_page": per_page,
-            "pages": (total + per_page - 1) // per_page
+            "pages": (total + per_page - 1) // per_page,
+            "discovery": DISCOVERY
         })
 
+@app.route("/api/transcode/discover", methods=["GET", "POST"])
+@requires_auth
+def api_transcode_discover():
+    """Start (POST) or check (GET) library-wide candidate discovery."""
+    if request.method == "POST":
+        if DISCOVERY["status"] == "running":
+            return jsonify({"status": "running", "message": "Discovery already running"}), 202
+        threading.Thread(target=discover_transcode_candidates, daemon=True).start()
+        return jsonify({"status": "started"}), 202
+    return jsonify(DISCOVERY)
+
+@app.route("/api/transcode/enqueue-all", methods=["POST"])
+@requires_auth
+def api_transcode_enqueue_all():
+    """Queue every candidate matching the list filters as bulk jobs, behind manual ones."""
+    data = request.get_json(silent=True) or {}
+    where, params = candidate_query(data)
+    with get_db() as conn:
+        paths = [row["path"] for row in conn.execute(
+            "SELECT m.path FROM media_info m LEFT JOIN videos v ON v.video_id = m.video_id" + where, params
+        )]
+    queued = 0
+    for path in paths:
+        queued += enqueue_transcode(path, priority=data.get('priority', BULK_PRIORITY))[1]
+    tlog(f"📥 Bulk queued {queued} of {len(paths)} candidates")
+    return jsonify({"queued": queued, "matched": len(paths)})
+
 @app.route("/api/transcode/start", methods=["POST"])
 @requires_auth
 def api_transcode_start():
-    """Start transcoding a video."""
+    """Queue a video for transcoding."""
     data = request.get_json()
     filepath = data.get('filepath')
     
     if not filepath:
         return jsonify({"error": "No filepath provided"}), 400
     
-    encoder = detect_encoder()
-    tlog(f"🖥️  Selected encoder: {encoder}")
-    
-    # Run in background
-    def run_transcode():
-        transcode_video(filepath, encoder)
-    
-    threading.Thread(target=run_transcode).start()
-    return jsonify({"message": "Transcode started", "encoder": encoder})
+    # Manual starts jump ahead of bulk work
+    job_id, created = enqueue_transcode(filepath, priority=data.get('priority', 10))
+    if created:
+        tlog(f"📥 Queued job {job_id}: {filepath}")
+        return jsonify({"message": "Transcode queued", "job_id": job_id})
+    return jsonify({"message": "Already queued", "job_id": job_id})
+
+@app.route("/api/transcode/jobs")
+@requires_auth
+def api_transcode_jobs():
+    """List transcode jobs, active first."""
+    status = request.args.get('status')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    with get_db() as conn:
+        counts = {row["status"]: row["n"] for row in
+                  conn.execute("SELECT status, COUNT(*) AS n FROM transcode_jobs GROUP BY status")}
+        query = "SELECT * FROM transcode_jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += """ ORDER BY CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END,
+                     CASE WHEN status IN ('running', 'queued') THEN -priority ELSE 0 END, id DESC LIMIT ?"""
+        params.append(limit)
+        jobs = [dict(row) for row in conn.execute(query, params)]
+    for job in jobs:
+        if job["status"] == "running":
+            job["progress"] = job_progress.get(job["id"])
+    return jsonify({"jobs": jobs, "counts": counts, "throttle": THROTTLE})
+
+@app.route("/api/transcode/stats")
+@requires_auth
+def api_transcode_stats():
+    """
+    Throughput per encoder and mode from finished encodes, plus what each
+    action type saved compared to running a full encode on the same media.
+    """
+    with get_db() as conn:
+        rows = conn.execute("""
+            SELECT encoder, mode, COUNT(*) AS jobs,
+                   SUM(duration) AS media_seconds, SUM(wall_seconds) AS wall_seconds,
+                   SUM(cpu_seconds) AS cpu_seconds,
+                   SUM(duration) / NULLIF(SUM(wall_seconds), 0) AS speed,
+                   SUM(cpu_seconds) / NULLIF(SUM(duration), 0) AS cpu_per_media_second,
+                   CAST(SUM(output_size) AS REAL) / NULLIF(SUM(input_size), 0) AS size_ratio
+            FROM transcode_stats WHERE mode != 'noop' GROUP BY encoder, mode ORDER BY encoder, mode
+        """).fetchall()
+        full = conn.execute("""
+            SELECT SUM(cpu_seconds) / NULLIF(SUM(duration), 0) AS cpu_rate,
+                   CAST(SUM(output_size) AS REAL) / NULLIF(SUM(input_size), 0) AS size_ratio
+            FROM transcode_stats WHERE mode = 'full'
+        """).fetchone()
+        savings = []
+        for row in conn.execute("""
+            SELECT mode, COUNT(*) AS files, SUM(duration) AS media_seconds, SUM(cpu_seconds) AS cpu_seconds,
+                   SUM(input_size) AS input_bytes, SUM(output_size) AS output_bytes
+            FROM transcode_stats GROUP BY mode ORDER BY mode
+        """):
+            entry = dict(row)
+            # Estimated cost of a full encode of the same media, from this host's own history
+            if row["mode"] != "full" and full["cpu_rate"] and row["media_seconds"]:
+                entry["cpu_seconds_saved"] = round(row["media_seconds"] * full["cpu_rate"] - (row["cpu_seconds"] or 0), 1)
+            else:
+                entry["cpu_seconds_saved"] = None
+            entry["bytes_saved"] = (row["input_bytes"] or 0) - (row["output_bytes"] or 0)
+            entry["bytes_written"] = 0 if row["mode"] == "noop" else row["output_bytes"]
+            savings.append(entry)
+    return jsonify({
+        "stats": [dict(row) for row in rows],
+        "savings": savings,
+        "full_cpu_per_media_second": full["cpu_rate"]
+    })
+
+@app.route("/api/transcode/encoders", methods=["GET", "POST"])
+@requires_auth
+def api_transcode_encoders():
+    """Ranked encoder detection results; POST re-runs the trial encodes."""
+    encoders = detect_encoders(refresh=request.method == "POST")
+    return jsonify({"encoders": encoders, "selected": detect_encoder()})
+
+@app.route("/api/transcode/jobs/<int:job_id>/cancel", methods=["POST"])
+@requires_auth
+def api_transcode_cancel(job_id):
+    if not cancel_transcode_job(job_id):
+        return jsonify({"error": "Job is not queued or running"}), 409
+    return jsonify({"success": True})
+
+@app.route("/api/transcode/jobs/<int:job_id>/retry", methods=["POST"])
+@requires_auth
+def api_transcode_retry(job_id):
+    if not retry_transcode_job(job_id):
+        return jsonify({"error": "Job cannot be retried"}), 409
+    return jsonify({"success": True})
 
 @app.route("/api/transcode/logs")
 @requires_auth
 def api_transcode_logs():
     """Get transcode logs."""
-    start = request.args.get('start', 0, type=int)
-    with transcode_log_lock:
-        return jsonify({
-            "logs": transcode_log_buffer[start:],
-            "next_index": len(transcode_log_buffer)
-        })
+    return log_page(transcode_log_buffer)
 
-# Global Scan State
-SCAN_CACHE = {
-    "status": "idle", # idle, scanning, done
-    "results": None,
-    "last_run": None 
-}
-SCAN_THREAD = None
+@app.route("/api/transcode/logs/stream")
+@requires_auth
+def api_transcode_logs_stream():
+    """Stream transcode logs (SSE)."""
+    return log_stream(transcode_log_buffer)
+
+# Recovery scan state. Results are written to recovery_results as each
+# channel finishes, so clients can page through them while the scan runs
+# and a restart doesn't lose what a long scan already found.
+RECOVERY_STATE_KEYS = ("status", "scan_id", "last_run", "error")
+
+def load_recovery_state():
+    with get_db() as conn:
+        state = {key: get_state(conn, f"recovery_{key}") or None for key in RECOVERY_STATE_KEYS}
+        state["status"] = state["status"] or "idle"
+        state["scan_id"] = int(state["scan_id"] or 0)
+        if state["status"] == "scanning":
+            # The process died mid-scan; keep the partial results
+            state["status"] = "interrupted"
+            set_state(conn, "recovery_status", "interrupted")
+            conn.commit()
+    return state
+
+SCAN_CACHE = load_recovery_state()
+recovery_lock = threading.Lock()
+
+def save_recovery_state(**changes):
+    SCAN_CACHE.update(changes)
+    with get_db() as conn:
+        for key in RECOVERY_STATE_KEYS:
+            set_state(conn, f"recovery_{key}", "" if SCAN_CACHE[key] is None else SCAN_CACHE[key])
+        conn.commit()
+
+def run_recovery_scan(scan_id):
+    """Runs scan_for_unindexed_videos() and persists its results under scan_id."""
+    def store(category, items):
+        with get_db() as conn:
+            conn.executemany(
+                "INSERT INTO recovery_results (scan_id, category, path, data) VALUES (?, ?, ?, ?)",
+                [(scan_id, category, item["path"], json.dumps(item)) for item in items]
+            )
+            conn.commit()
+
+    try:
+        scan_for_unindexed_videos(on_results=store)
+        save_recovery_state(status="done", last_run=datetime.now().isoformat())
+    except Exception as e:
+        save_recovery_state(status="error", error=str(e))
+        log(f"❌ Async scan failed: {e}")
+
+def forget_recovery_result(path):
+    """Drops a handled file from the stored scan results."""
+    with get_db() as conn:
+        conn.execute("DELETE FROM recovery_results WHERE path = ?", (str(path),))
+        conn.commit()
 
 @app.route("/api/recovery/scan", methods=["POST"])
 @requires_auth
 def api_recovery_scan():
-    global SCAN_THREAD
-    
-    if SCAN_CACHE["status"] == "scanning":
-        return jsonify({"status": "running", "message": "Scan already in progress"}), 202
+    with recovery_lock:
+        if SCAN_CACHE["status"] == "scanning":
+            return jsonify({"status": "running", "message": "Scan already in progress"}), 202
+        scan_id = SCAN_CACHE["scan_id"] + 1
+        with get_db() as conn:
+            conn.execute("DELETE FROM recovery_results")
+            conn.commit()
+        # Set status IMMEDIATELY to avoid race condition where poll sees "idle"
+        save_recovery_state(status="scanning", scan_id=scan_id, error=None)
 
-    def run_scan_async():
-        global SCAN_CACHE
-        # SCAN_CACHE["status"] = "scanning" # Already set in main thread
-        SCAN_CACHE["results"] = None
-        try:
-            results = scan_for_unindexed_videos()
-            SCAN_CACHE["results"] = results
-            SCAN_CACHE["status"] = "done"
-            SCAN_CACHE["last_run"] = datetime.now().isoformat()
-        except Exception as e:
-            SCAN_CACHE["status"] = "error"
-            SCAN_CACHE["results"] = str(e)
-            log(f"❌ Async scan failed: {e}")
-
-    # Set status IMMEDIATELY to avoid race condition where poll sees "idle"
-    SCAN_CACHE["status"] = "scanning"
-    SCAN_THREAD = threading.Thread(target=run_scan_async)
-    SCAN_THREAD.start()
-    
-    return jsonify({"status": "started", "message": "Background scan started"}), 202
+    threading.Thread(target=run_recovery_scan, args=(scan_id,), daemon=True).start()
+    return jsonify({"status": "started", "scan_id": scan_id, "message": "Background scan started"}), 202
 
 @app.route("/api/recovery/poll", methods=["GET"])
 @requires_auth
 def api_recovery_poll():
-    return jsonify(SCAN_CACHE)
+    """
+    Scan status plus the results added after cursor `since` (a result id),
+    grouped by category. Clients pass back `next` to get only new entries,
+    and start over from 0 when scan_id changes.
+    """
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 2000, type=int), 1), 10000)
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT id, category, data FROM recovery_results WHERE id > ? ORDER BY id LIMIT ?",
+            (since, limit)
+        ).fetchall()
+        counts = dict(conn.execute(
+            "SELECT category, COUNT(*) FROM recovery_results GROUP BY category"
+        ).fetchall())
+    results = {"unindexed": [], "redundant": [], "rescue": [], "lost": []}
+    for row in rows:
+        results.setdefault(row["category"], []).append(json.loads(row["data"]))
+    return jsonify({
+        **SCAN_CACHE,
+        "results": results,
+        "counts": counts,
+        "next": rows[-1]["id"] if rows else since,
+        "more": len(rows) == limit
+    })
 
 @app.route("/api/recovery/start", methods=["POST"])
 @requires_auth
@@ -1121,16 +3825,44 @@ def api_recovery_start():
     if not filepath:
         return jsonify({"error": "No filepath provided"}), 400
         
-    # Run synchronously to give user immediate feedback per file
+    # The metadata fetch runs here to give immediate feedback per file;
+    # the video copy continues in the background (see /api/recovery/copies)
     success, msg = recover_video_metadata(filepath)
     log(f"Recovery Result for {filepath}: {msg}")
     
     return jsonify({
         "message": msg, 
         "success": success,
-        "status": "completed" if success else "failed" 
+        "status": "copying" if success else "failed" 
     })
 
+@app.route("/api/recovery/bulk", methods=["POST"])
+@requires_auth
+def api_recovery_bulk():
+    """Queues many files for background recovery; poll /api/recovery/jobs for status."""
+    data = request.get_json() or {}
+    filepaths = data.get('filepaths') or []
+    if not filepaths:
+        return jsonify({"error": "No filepaths provided"}), 400
+    summary = enqueue_recovery(filepaths, force=bool(data.get('force')))
+    log(f"🚑 Queued {summary['queued']} files for recovery ({summary['unavailable']} known unavailable)")
+    return jsonify(summary)
+
+@app.route("/api/recovery/jobs", methods=["GET"])
+@requires_auth
+def api_recovery_jobs():
+    status = request.args.get("status")
+    limit = request.args.get("limit", 500, type=int)
+    with get_db() as conn:
+        if status:
+            rows = conn.execute(
+                "SELECT * FROM recovery_jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM recovery_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM recovery_jobs GROUP BY status").fetchall())
+    return jsonify({"jobs": [dict(row) for row in rows], "counts": counts})
+
 @app.route("/api/recovery/delete", methods=["POST"])
 @requires_auth
 def api_recovery_delete():
@@ -1175,12 +3907,36 @@ def api_recovery_delete():
                 conn.execute("DELETE FROM lost_media WHERE video_id = ?", (vid_id,))
                 conn.commit()
 
+        forget_recovery_result(filepath)
         log(f"🗑️ Deleted file: {filepath}")
         return jsonify({"success": True, "message": "File deleted"})
     except Exception as e:
         log(f"❌ Delete failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+def finish_import(src_path, dest_video, vid_id, filepath):
+    """Stages a video whose metadata is already in IMPORT_DIR, then drops it from Lost Media and the scan results."""
+    try:
+        stage_import_video(src_path, dest_video)
+    except Exception as e:
+        log(f"   ❌ Import staging failed for {src_path.name}: {e}")
+        return
+    # Clean up lost_media table
+    with get_db() as conn:
+        conn.execute("DELETE FROM lost_media WHERE video_id = ?", (vid_id,))
+        conn.commit()
+    forget_recovery_result(filepath)
+    metadata_snapshot.invalidate()
+    log(f"   ✅ Ready for import: {src_path.name}")
+
+@app.route("/api/recovery/copies", methods=["GET"])
+@requires_auth
+def api_recovery_copies():
+    with copies_lock:
+        prune_copies()
+        copies = [dict(c) for c in COPIES.values()]
+    return jsonify({"copies": copies})
+
 @app.route('/api/recovery/force', methods=['POST'])
 @requires_auth
 def api_recovery_force():
@@ -1222,22 +3978,12 @@ def api_recovery_force():
             json.dump(offline_meta, f, indent=4)
         log("   📝 Generated offline metadata.")
         
-        # 2. Link/Copy Video
+        # 2. Link/Copy Video. A copy across filesystems can take minutes, so it
+        # runs in the background; /api/recovery/copies shows its progress.
         dest_video = IMPORT_DIR / src_path.name
-        if dest_video.exists(): dest_video.unlink()
-        try:
-            os.link(src_path, dest_video)
-            log("   🔗 Hardlinked video.")
-        except OSError:
-            shutil.copy2(src_path, dest_video)
-            log("   ©️ Copied video.")
-            
-        # 3. Clean up lost_media table
-        with get_db() as conn:
-            conn.execute("DELETE FROM lost_media WHERE video_id = ?", (vid_id,))
-            conn.commit()
-            
-        return jsonify({"success": True, "message": "Force import successful"})
+        threading.Thread(target=finish_import, args=(src_path, dest_video, vid_id, filepath), daemon=True).start()
+
+        return jsonify({"success": True, "message": "Force import started", "status": "copying"})
         
     except Exception as e:
         log(f"   ❌ Force import failed: {e}")
@@ -1282,8 +4028,23 @@ def api_remove_hidden():
     return jsonify({"success": True})
     
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Organize TubeArchivist downloads into a symlink tree.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the reconcile plan and its counts, then exit without changing the tree")
+    args = parser.parse_args()
+    if args.dry_run:
+        print_plan(plan_library())
+        sys.exit(0)
+
     # Start scheduler in background thread
     thread = threading.Thread(target=scheduler, daemon=True)
     thread.start()
+
+    if WATCH_MODE != "off":
+        threading.Thread(target=watcher, daemon=True).start()
+
+    start_transcode_workers()
+    start_recovery_workers()
     
     app.run(host="0.0.0.0", port=5000)